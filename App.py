@@ -1,198 +1,186 @@
 import streamlit as st
+import csv
 import datetime
-import os
-from fpdf import FPDF
-from io import BytesIO
-
-class SLATemplate(FPDF):
-    def __init__(self):
-        super().__init__()
-        # Further increase margins to prevent overlapping
-        self.set_margins(left=25, top=55, right=25)  # Increased top margin
-        # Increase bottom margin significantly
-        self.set_auto_page_break(auto=True, margin=40)  # Increased bottom margin
-        # Set default line height
-        self.set_line_height(6.5)
-
-    def set_line_height(self, height):
-        self.cell_height = height
-
-    def header(self):
-        # Add background template if exists
-        if os.path.exists('background_template.jpg'):
-            self.image('background_template.jpg', x=0, y=0, w=210, h=297)  # A4 size
-        elif os.path.exists('background_template.png'):
-            self.image('background_template.png', x=0, y=0, w=210, h=297)  # A4 size
-        
-        # Move header up - start at y=10
-        self.set_y(10)
-        
-        # Logo placeholder (left side) with adjusted position
-        if os.path.exists('logo.png'):
-            self.image('logo.png', x=25, y=10, w=30)
-        
-        # Title (center) with increased spacing
-        self.set_font('Arial', 'B', 14)
-        self.set_text_color(0, 51, 102)
-        self.cell(0, 12, 'SERVICE LEVEL AGREEMENT', 0, 1, 'C')
-        
-        # Reset text color for content
-        self.set_text_color(0, 0, 0)
-        
-        # Reset to content start position - moved up
-        self.set_y(40)  # Start content higher
-
-    def footer(self):
-        # Move footer text to the very bottom of the page
-        self.set_y(-15)  # -15 is the absolute bottom position
-        self.set_font('Arial', 'I', 8)
-        self.set_text_color(0, 51, 102)
-        self.cell(0, 10, 'B.K.R Support Services W.L.L', 0, 0, 'C')
-        self.set_text_color(0, 0, 0)
-
-def format_services_list(services):
-    """Format the services list for PDF"""
-    return "\n".join(f"- {service.strip()}" for service in services if service.strip())
-
-def format_payment_terms(advance, remaining):
-    """Format payment terms for PDF"""
-    return (
-        f"- {advance}% advance payment upon signing this agreement\n"
-        f"- Remaining {remaining}% upon completion of VAT registration\n"
-        "- All payments are non-refundable"
+import tempfile
+import time
+from io import BytesIO, TextIOWrapper
+from streamlit import runtime
+import instrumentation
+from archive import archive
+from batch import assign_refs, parse_records
+from generator import DraftTemplate, DocumentGenerator
+from ref_allocator import RefError, allocator
+from render_cache import RenderCache, canonical_hash
+from validation import validate_records
+from zip_export import export_zip
+
+@st.cache_resource
+def load_resources():
+    """Load fonts and the background once per server process, shared across reruns and sessions"""
+    DocumentGenerator.load_resources()
+    return True
+
+@st.cache_resource
+def get_render_cache():
+    """Bounded LRU of rendered PDFs shared by all sessions"""
+    return RenderCache(maxsize=64, max_bytes=64 * 1024 * 1024)
+
+@st.cache_data(max_entries=8)
+def read_archived(sha256):
+    """Stored PDF bytes, kept across reruns; archived files never change"""
+    return archive.read(sha256)
+
+def render_pdf(data):
+    """Render an SLA to PDF bytes"""
+    with instrumentation.request("app") as profile:
+        pdf = DocumentGenerator.create_pdf(data)
+        # Stream straight into a binary buffer; getvalue() hands over its bytes without another copy
+        sink = BytesIO()
+        pdf.output_to(sink)
+    st.session_state.timing = profile
+    pdf_bytes = sink.getvalue()
+    # Every newly rendered document goes into the archive for later re-download
+    archive.store(pdf_bytes, data)
+    st.session_state.pop("archive_results", None)
+    return pdf_bytes
+
+def render_draft(data):
+    """Render a quick DRAFT preview of the form; drafts are neither cached nor archived"""
+    pdf = DocumentGenerator.create_pdf(data, template_class=DraftTemplate)
+    sink = BytesIO()
+    pdf.output_to(sink)
+    return sink.getvalue()
+
+def draft_url(draft):
+    """Serve a draft from Streamlit's media endpoint, the way st.image serves images.
+
+    Browsers show a PDF served over HTTP inline, where data: URLs in iframes
+    are blocked. Files are keyed by content, so an unchanged draft keeps its
+    URL, and each rerun replaces the session's previous draft. Streamlit has
+    no public API for this, so None is returned when the media file manager
+    is not there or has changed.
+    """
+    if not runtime.exists():
+        return None
+    try:
+        url = runtime.get_instance().media_file_mgr.add(draft, "application/pdf", "sla-draft-preview")
+    except (AttributeError, TypeError):
+        return None
+    base = st.get_option("server.baseUrlPath").strip("/")
+    return f"/{base}{url}" if base else url
+
+def show_draft_preview(data):
+    """Inline preview re-rendered on every change to the form"""
+    st.subheader("Preview")
+    if not st.toggle("Live preview", value=True):
+        return
+    start = time.perf_counter()
+    try:
+        draft = render_draft(dict(data, ref_number="DRAFT"))
+    except Exception as e:
+        st.caption(f"Preview unavailable: {str(e)}")
+        return
+    st.caption(f"Draft rendered in {(time.perf_counter() - start) * 1000:.0f} ms · {len(draft) / 1024:.0f} KB. "
+               "The download uses the full fonts and background.")
+    url = draft_url(draft)
+    if url is None:
+        st.download_button("Open draft", data=draft, file_name="SLA_draft.pdf", mime="application/pdf")
+        return
+    st.markdown(
+        f'<iframe src="{url}#toolbar=0" width="100%" height="800"></iframe>',
+        unsafe_allow_html=True,
     )
 
-class DocumentGenerator:
-    @staticmethod
-    def create_pdf(data):
-        try:
-            pdf = SLATemplate()
-            
-            try:
-                pdf.add_font('Arial', '', 'arial.ttf', uni=True)
-                pdf.add_font('Arial', 'B', 'arialbd.ttf', uni=True)
-                pdf.add_font('Arial', 'I', 'ariali.ttf', uni=True)
-            except Exception as e:
-                print(f"Warning: Could not load Arial fonts, falling back to default: {str(e)}")
-                pdf.set_font('Arial', '', 10)
-            
-            pdf.add_page()
-
-            # Header Information
-            pdf.set_font('Arial', 'B', 12)
-            pdf.cell(0, 8, f"Ref: {data['ref_number']}", ln=True)
-            pdf.cell(0, 8, f"Date: {data['current_date']}", ln=True)
-            pdf.ln(5)
-
-            # Client Details
-            pdf.cell(0, 8, "TO:", ln=True)
-            pdf.set_font('Arial', '', 10)
-            pdf.cell(0, 6, data['client_name'], ln=True)
-            pdf.cell(0, 6, f"CR No: {data['commercial_registration_number']}", ln=True)
-            pdf.cell(0, 6, f"Attn: {data['attention']}", ln=True)
-            pdf.cell(0, 6, f"Email: {data['email']}", ln=True)
-            pdf.ln(8)
-
-            # Template text with placeholders
-            template_text = f"""
-This Service Level Agreement (hereinafter referred to as "Agreement") is made and entered into on {data['agreement_date']} by and between:
-
-B.K.R Support Services W.L.L, a company incorporated under the laws of the Kingdom of Bahrain (hereinafter referred to as "Service Provider")
-
-AND
-
-{data['client_name']}, with Commercial Registration No. {data['commercial_registration_number']}, having its registered office in the Kingdom of Bahrain (hereinafter referred to as "Client").
-
-OWNERSHIP STRUCTURE
-The Client's ownership structure is as follows:
-- Bahraini Ownership: {data['bahraini_ownership']}%
-- GCC Nationals: {data['gcc_ownership']}%
-- American Nationals: {data['american_ownership']}%
-- Foreign Ownership: {data['foreign_ownership']}%
-
-BUSINESS ACTIVITIES
-The Client is engaged in the following business activities:
-1. Primary Activity:
-   ISIC4 Code: {data['isic_code_1']}
-   Activity Name: {data['activity_name_1']}
-   Description: {data['activity_desc_1']}
-
-2. Secondary Activity:
-   ISIC4 Code: {data['isic_code_2']}
-   Activity Name: {data['activity_name_2']}
-   Description: {data['activity_desc_2']}
-
-SCOPE OF SERVICES
-The Service Provider agrees to provide the following services to the Client:
-{format_services_list(data['services'])}
-
-FEES AND PAYMENT STRUCTURE
-1. Registration and Setup Costs:
-   - Company Formation: BHD {data['company_formation_cost']:.3f}
-   - Desk-Space Office Rental: BHD {data['desk_space_cost']:.3f}
-   - Businessman Visa: BHD {data['businessman_visa_cost']:.3f}
-   - Power of Attorney: BHD {data['poa_cost']:.3f}
-
-2. Administrative Costs:
-   - Labour Authority Registration: BHD {data['labor_auth_cost']:.3f}
-   - Social Insurance Registration: BHD {data['social_insurance_cost']:.3f}
-   - Miscellaneous/Admin Charges: BHD {data['misc_charges']:.3f}
-   - Estimation Charges (Per Head): BHD {data['estimation_charges']:.3f}
-   - Free Advice/Guidance: BHD {data['free_advice_cost']:.3f}
-
-3. VAT Services:
-   - VAT Registration Fee: BHD {data['vat_registration_fee']:.3f}
-   - Consultancy Fee: BHD {data['consultancy_fee']:.3f}
-   Total VAT Services Fee: BHD {(data['vat_registration_fee'] + data['consultancy_fee']):.3f}
-
-PAYMENT TERMS
-{format_payment_terms(data['advance_payment'], data['remaining_payment'])}
-
-DELIVERABLES
-The Service Provider shall deliver:
-1. Complete company registration documentation
-2. VAT Registration Certificate
-3. Ongoing support during the registration process
-4. Advisory services as specified in the scope of services
-
-TERM AND TERMINATION
-This Agreement shall commence on {data['agreement_date']} and shall continue until the completion of the services outlined herein.
-"""
+def show_timing_panel():
+    """Per-request stage breakdown and process totals in the sidebar"""
+    st.sidebar.subheader("Render timing")
+    profile = st.session_state.get("timing")
+    if profile is None:
+        st.sidebar.caption("No render yet, or the last PDF was served from cache.")
+    else:
+        st.sidebar.metric("Total", f"{profile.total * 1000:.1f} ms")
+        st.sidebar.table([
+            {"stage": name, "ms": round(seconds * 1000, 2), "calls": calls}
+            for name, seconds, calls in profile.breakdown()
+        ])
+    with st.sidebar.expander("Prometheus snapshot"):
+        st.code(instrumentation.prometheus_snapshot(), language="text")
+
+def show_archive():
+    """Search previously generated SLAs and download their stored PDFs"""
+    st.subheader("Archive")
+    with st.form("archive_search"):
+        query = st.text_input("Search by client, CR number, reference or activity")
+        searched = st.form_submit_button("Search")
+    # Every keystroke in the SLA form reruns the script, so the archive is only
+    # queried on a search or after render_pdf has stored a new document
+    if searched or "archive_results" not in st.session_state:
+        st.session_state.archive_results = (query, archive.search(query))
+    query, results = st.session_state.archive_results
+    if not results:
+        st.caption("No archived documents match." if query else "No documents archived yet.")
+    for document in results:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.write(f"**{document['client_name'] or 'Unnamed client'}** · {document['ref_number']} · "
+                     f"CR {document['cr_number'] or '-'} · {document['created_at']}")
+        with col2:
+            # Only the selected document is read from disk, not every listed one on every rerun
+            if st.button("Select", key=f"archive-{document['id']}"):
+                st.session_state.archive_selected = document
+    document = st.session_state.get("archive_selected")
+    if document is not None:
+        st.download_button(
+            f"Download {document['ref_number'] or 'selected document'}",
+            data=read_archived(document['sha256']),
+            file_name=f"SLA_{document['ref_number'].replace('/', '_')}.pdf",
+            mime="application/pdf",
+        )
 
-            # Add the template text to PDF
-            pdf.set_font('Arial', '', 10)
-            pdf.multi_cell(0, 6, template_text)
-            
-            # Signature Section
-            pdf.ln(10)
-            pdf.line(25, pdf.get_y(), 95, pdf.get_y())
-            pdf.line(120, pdf.get_y(), 185, pdf.get_y())
-            
-            pdf.set_y(pdf.get_y() + 5)
-            pdf.cell(95, 5, "Client Signature & Stamp", 0, 0, 'L')
-            pdf.cell(0, 5, "For B.K.R Support Services W.L.L", 0, 1, 'L')
-            
-            pdf.set_y(pdf.get_y() + 15)
-            pdf.cell(95, 5, f"Name: {data['signatory_name']}", 0, 0, 'L')
-            pdf.cell(0, 5, "Name: _______________________", 0, 1, 'L')
-            
-            pdf.set_y(pdf.get_y() + 15)
-            pdf.cell(95, 5, f"Passport Number: {data['passport_number']}", 0, 0, 'L')
-            pdf.cell(0, 5, "Date: _______________________", 0, 1, 'L')
-            
-            return pdf
-            
-        except Exception as e:
-            raise Exception(f"Error creating PDF: {str(e)}")
+def show_batch_export():
+    """Render every record of an uploaded CSV or JSONL file into one ZIP download"""
+    st.subheader("Download all")
+    # In a form, so the upload is only read when the button is pressed and not on every rerun
+    with st.form("batch_export"):
+        upload = st.file_uploader("Client records (CSV or JSONL, one client per row)", type=["csv", "jsonl"])
+        submitted = st.form_submit_button("Render all to ZIP")
+    if submitted and upload is not None:
+        st.session_state.pop("export_zip", None)
+        lines = TextIOWrapper(upload, encoding="utf-8", newline="")
+        try:
+            records = list(parse_records(lines, upload.name.lower().endswith(".csv")))
+        except (ValueError, csv.Error) as e:
+            st.error(f"Could not read {upload.name}: {str(e)}")
+            return
+        report = validate_records(records)
+        if report:
+            st.warning(f"{len(report)} of {report.rows} records have errors and will be skipped:\n\n"
+                       + "\n".join(f"- {line}" for line in report.lines()))
+        # Reference numbers for the whole upload are reserved in one transaction, as the server's /export does
+        assign_refs([record for index, record in enumerate(records, start=1) if index not in report])
+        # Documents are streamed into a file on disk one at a time instead of being collected in memory;
+        # the file is removed once closed, and the download button needs the finished archive as bytes anyway
+        with tempfile.TemporaryFile(prefix="sla-export-", suffix=".zip") as f:
+            with st.spinner("Rendering..."):
+                generated, failed = export_zip(records, f, report=report)
+            f.seek(0)
+            st.session_state.export_zip = (f.read(), generated, failed)
+    if "export_zip" in st.session_state:
+        zip_bytes, generated, failed = st.session_state.export_zip
+        st.caption(f"{generated} documents rendered" + (f", {failed} failed (see manifest.jsonl)" if failed else ""))
+        st.download_button("Download all (ZIP)", data=zip_bytes, file_name="SLA_export.zip", mime="application/zip")
 
 def main():
     st.set_page_config(page_title="SLA Generator", layout="wide")
     st.title("Service Level Agreement Generator")
+    load_resources()
 
     if 'pdf_data' not in st.session_state:
         st.session_state.pdf_data = None
 
-    with st.form("sla_form"):
+    # Widgets are not in a form, so every change reruns the script and refreshes the draft preview
+    form_col, preview_col = st.columns([3, 2])
+    with form_col:
         st.subheader("Basic Information")
         client_name = st.text_input("Client Name")
         cr_number = st.text_input("CR Number")
@@ -240,55 +228,73 @@ def main():
         st.subheader("Service Details")
         vat_registration_fee = st.number_input("VAT Registration Fee (BHD)", min_value=0.0)
         consultancy_fee = st.number_input("Consultancy Fee (BHD)", min_value=0.0)
-        ref_sequence = st.text_input("Reference Sequence Number", max_chars=3)
+        ref_sequence = st.text_input("Reference Sequence Number (leave blank for the next free one)", max_chars=3)
         services = st.text_area("Services (Comma-separated)").split(",")
         
         advance_payment = st.slider("Advance Payment (%)", 0, 100, 50)
         remaining_payment = st.slider("Remaining Payment (%)", 0, 100, 50)
 
-        submitted = st.form_submit_button("Generate SLA")
+        data = {
+            "current_date": datetime.datetime.now().strftime("%d/%m/%Y"),
+            "agreement_date": agreement_date.strftime("%d/%m/%Y"),
+            "client_name": client_name,
+            "commercial_registration_number": cr_number,
+            "attention": attention,
+            "email": email,
+            "bahraini_ownership": bahraini_ownership,
+            "gcc_ownership": gcc_ownership,
+            "american_ownership": american_ownership,
+            "foreign_ownership": foreign_ownership,
+            "isic_code_1": isic_code_1,
+            "activity_name_1": activity_name_1,
+            "activity_desc_1": activity_desc_1,
+            "isic_code_2": isic_code_2,
+            "activity_name_2": activity_name_2,
+            "activity_desc_2": activity_desc_2,
+            "company_formation_cost": company_formation_cost,
+            "desk_space_cost": desk_space_cost,
+            "businessman_visa_cost": businessman_visa_cost,
+            "misc_charges": misc_charges,
+            "poa_cost": poa_cost,
+            "estimation_charges": estimation_charges,
+            "labor_auth_cost": labor_auth_cost,
+            "social_insurance_cost": social_insurance_cost,
+            "free_advice_cost": free_advice_cost,
+            "signatory_name": signatory_name,
+            "passport_number": passport_number,
+            "vat_registration_fee": vat_registration_fee,
+            "consultancy_fee": consultancy_fee,
+            "services": services,
+            "advance_payment": advance_payment,
+            "remaining_payment": remaining_payment,
+        }
+
+        submitted = st.button("Generate SLA", type="primary")
 
         if submitted:
-            data = {
-                "current_date": datetime.datetime.now().strftime("%d/%m/%Y"),
-                "agreement_date": agreement_date.strftime("%d/%m/%Y"),
-                "ref_number": f"BKR/VAT/{datetime.datetime.now().year}/{datetime.datetime.now().strftime('%m')}/{ref_sequence.zfill(3)}",
-                "client_name": client_name,
-                "commercial_registration_number": cr_number,
-                "attention": attention,
-                "email": email,
-                "bahraini_ownership": bahraini_ownership,
-                "gcc_ownership": gcc_ownership,
-                "american_ownership": american_ownership,
-                "foreign_ownership": foreign_ownership,
-                "isic_code_1": isic_code_1,
-                "activity_name_1": activity_name_1,
-                "activity_desc_1": activity_desc_1,
-                "isic_code_2": isic_code_2,
-                "activity_name_2": activity_name_2,
-                "activity_desc_2": activity_desc_2,
-                "company_formation_cost": company_formation_cost,
-                "desk_space_cost": desk_space_cost,
-                "businessman_visa_cost": businessman_visa_cost,
-                "misc_charges": misc_charges,
-                "poa_cost": poa_cost,
-                "estimation_charges": estimation_charges,
-                "labor_auth_cost": labor_auth_cost,
-                "social_insurance_cost": social_insurance_cost,
-                "free_advice_cost": free_advice_cost,
-                "signatory_name": signatory_name,
-                "passport_number": passport_number,
-                "vat_registration_fee": vat_registration_fee,
-                "consultancy_fee": consultancy_fee,
-                "services": services,
-                "advance_payment": advance_payment,
-                "remaining_payment": remaining_payment,
-            }
+            # Resubmitting the same form keeps its reference number instead of using up a new one
+            ref_key = canonical_hash(dict(data, ref_sequence=ref_sequence))
+            refs = st.session_state.setdefault("refs", {})
+            try:
+                if ref_key not in refs:
+                    refs[ref_key] = allocator.ref_for(ref_sequence)
+            except RefError as e:
+                st.error(f"{str(e)}. Enter another sequence number or leave it blank." if ref_sequence.strip() else str(e))
+            else:
+                data["ref_number"] = refs[ref_key]
+
+                # current_date and ref_number are part of the key, so identical
+                # submissions hit the cache only while they would render the same text
+                st.session_state.timing = None
+                st.session_state.pdf_data = get_render_cache().get_or_render(data, render_pdf)
 
-            pdf = DocumentGenerator.create_pdf(data)
-            st.session_state.pdf_data = pdf.output(dest='S').encode('latin1')
+    with preview_col:
+        show_draft_preview(data)
 
-    # Download button outside the form
+    if instrumentation.enabled():
+        show_timing_panel()
+
+    # Download of the full-fidelity document
     if st.session_state.pdf_data is not None:
         st.download_button(
             "Download SLA PDF",
@@ -297,6 +303,9 @@ def main():
             mime="application/pdf"
         )
 
+    show_batch_export()
+    show_archive()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,155 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from sqlite_db import LocalConnection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.environ.get("SLA_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+
+# Data fields indexed as the free-text "activities" column
+ACTIVITY_FIELDS = (
+    "isic_code_1", "activity_name_1", "activity_desc_1",
+    "isic_code_2", "activity_name_2", "activity_desc_2",
+)
+SERVICE_FIELDS = ("services", "additional_services")
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents ("
+    " id INTEGER PRIMARY KEY,"
+    " sha256 TEXT NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " template TEXT NOT NULL,"
+    " ref_number TEXT,"
+    " client_name TEXT,"
+    " cr_number TEXT,"
+    " created_at TEXT NOT NULL,"
+    " data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS documents_ref ON documents (ref_number)",
+    "CREATE INDEX IF NOT EXISTS documents_sha ON documents (sha256)",
+)
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+    " ref_number, client_name, cr_number, activities)"
+)
+
+
+def _activities(data):
+    parts = [str(data.get(field) or "") for field in ACTIVITY_FIELDS]
+    for field in SERVICE_FIELDS:
+        value = data.get(field) or []
+        parts.extend([value] if isinstance(value, str) else [str(item) for item in value])
+    return " ".join(part for part in parts if part.strip())
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    words = re.findall(r"[\w/-]+", text)
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class Archive:
+    """Content-addressed store of rendered PDFs with a searchable SQLite index.
+
+    Each PDF is written once under objects/ by the SHA-256 of its bytes, and
+    every issued document gets an index row with its data, searchable by
+    client name, CR number, reference number and business activities through
+    an FTS5 table. Downloads read the stored bytes; nothing is re-rendered.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self._db = LocalConnection(os.path.join(directory, "index.db"), self._setup, sqlite3.Row)
+
+    def _setup(self, conn):
+        os.makedirs(self.objects, exist_ok=True)
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute(FTS_SCHEMA)
+
+    def _connection(self):
+        return self._db.get()
+
+    def path(self, sha256):
+        """Location of a stored PDF"""
+        return os.path.join(self.objects, sha256[:2], sha256 + ".pdf")
+
+    def store(self, pdf_bytes, data, template="agreement"):
+        """Store a rendered PDF and index it, returning the new document id"""
+        sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp, path)
+        row = (
+            sha256, len(pdf_bytes), template,
+            str(data.get("ref_number") or ""), str(data.get("client_name") or ""),
+            str(data.get("commercial_registration_number") or ""),
+            datetime.datetime.now().isoformat(timespec="seconds"),
+            json.dumps(data, default=str, ensure_ascii=False),
+        )
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "INSERT INTO documents (sha256, size, template, ref_number, client_name, cr_number, created_at, data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            doc_id = cursor.lastrowid
+            conn.execute(
+                "INSERT INTO documents_fts (rowid, ref_number, client_name, cr_number, activities)"
+                " VALUES (?, ?, ?, ?, ?)", (doc_id, row[3], row[4], row[5], _activities(data)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return doc_id
+
+    def store_file(self, path, data, template="agreement"):
+        """Archive a PDF already written to disk"""
+        with open(path, "rb") as f:
+            return self.store(f.read(), data, template)
+
+    def search(self, text="", limit=20):
+        """Most recent documents matching every word of text as a prefix, newest first"""
+        conn = self._connection()
+        query = _fts_query(text)
+        if not query:
+            return [dict(row) for row in conn.execute(
+                "SELECT id, sha256, size, template, ref_number, client_name, cr_number, created_at"
+                " FROM documents ORDER BY id DESC LIMIT ?", (limit,))]
+        return [dict(row) for row in conn.execute(
+            "SELECT d.id, d.sha256, d.size, d.template, d.ref_number, d.client_name, d.cr_number, d.created_at"
+            " FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid"
+            " WHERE documents_fts MATCH ? ORDER BY d.id DESC LIMIT ?", (query, limit))]
+
+    def get(self, doc_id):
+        """Index row of a document, including its data, or None"""
+        row = self._connection().execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return None
+        document = dict(row)
+        document["data"] = json.loads(document["data"])
+        return document
+
+    def find_ref(self, ref_number):
+        """Latest document issued with a reference number, or None"""
+        row = self._connection().execute(
+            "SELECT id FROM documents WHERE ref_number = ? ORDER BY id DESC LIMIT 1", (ref_number,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def read(self, sha256):
+        """Stored PDF bytes"""
+        with open(self.path(sha256), "rb") as f:
+            return f.read()
+
+
+# Shared by every caller in the process
+archive = Archive()
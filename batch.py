@@ -0,0 +1,388 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import instrumentation
+from archive import archive
+from compression import COMPRESSION_LEVELS, COMPRESSION_PROFILES
+from generator import DEFAULT_TEMPLATE, DocumentGenerator
+from image_resources import DEFAULT_DPI, image_store
+from ref_allocator import RefError, allocator
+from render_cache import canonical_hash
+from subsetting import SUBSET_MODES
+from validation import FLOAT_FIELDS, INT_FIELDS, SPLIT_FIELDS, validate_records
+
+# Written into the output directory; maps input hashes to the files they produced
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def parse_records(lines, csv_format=False):
+    """Yield client records one at a time from CSV or JSONL text lines"""
+    if csv_format:
+        for row in csv.DictReader(lines):
+            yield dict(row)
+        return
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_records(path):
+    """Read client records from a CSV or JSONL file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(parse_records(f, path.lower().endswith(".csv")))
+
+
+def normalize_record(record):
+    """Coerce a raw input record into the data dict expected by create_pdf"""
+    data = dict(record)
+    now = datetime.datetime.now()
+    data.setdefault("current_date", now.strftime("%d/%m/%Y"))
+    if not data.get("ref_number"):
+        data["ref_number"] = allocator.ref_for(data.get("ref_sequence"), now)
+    for field in FLOAT_FIELDS:
+        if field in data:
+            data[field] = float(data[field] or 0)
+    for field in INT_FIELDS:
+        if field in data:
+            data[field] = int(float(data[field] or 0))
+    # Services are comma-separated in the Streamlit form and in CSV input
+    for field in SPLIT_FIELDS:
+        if isinstance(data.get(field), str):
+            data[field] = data[field].split(",")
+    return data
+
+
+def assign_refs(records, when=None):
+    """Give records without a reference number or sequence one each, reserved in a single transaction.
+
+    When the month has too few numbers left the records are left as they are,
+    so normalize_record allocates them one by one and reports the rows that
+    find none.
+    """
+    missing = [
+        record for record in records
+        if not record.get("ref_number") and not str(record.get("ref_sequence") or "").strip()
+    ]
+    if missing:
+        try:
+            refs = allocator.allocate(len(missing), when)
+        except RefError:
+            return records
+        for record, ref_number in zip(missing, refs):
+            record["ref_number"] = ref_number
+    return records
+
+
+def output_filename(index, data):
+    """Build a unique output file name for a record"""
+    client = str(data.get("client_name", "")).replace(" ", "_").replace(os.sep, "_")
+    return f"SLA_{index:05d}_{client}.pdf"
+
+
+def load_manifest(output_dir):
+    """Documents recorded by the previous run in output_dir, as lists keyed by input hash"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("documents", {})
+
+
+def save_manifest(output_dir, documents, versions):
+    """Atomically replace the output directory's manifest"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "resources": versions, "documents": documents}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _init_worker(background_dpi=DEFAULT_DPI, template=DEFAULT_TEMPLATE, subset=None, compression=None):
+    """Load fonts, the background and the template once per worker process"""
+    image_store.configure(dpi=background_dpi)
+    DocumentGenerator.load_resources(template, subset, compression)
+
+
+def render_record(index, record, output_dir, subset='document', template=DEFAULT_TEMPLATE, compression=None,
+                  archived=False, name=None):
+    """Render one record to a PDF file, returning (index, path, error)"""
+    try:
+        data = normalize_record(record)
+        path = os.path.join(output_dir, name or output_filename(index, data))
+        with instrumentation.request(f"batch:{index}"):
+            pdf = DocumentGenerator.create_pdf(data, subset=subset, template=template, compression=compression)
+            pdf.output_file(path)
+        if archived:
+            archive.store_file(path, data, template)
+        return index, path, None
+    except Exception as e:
+        return index, None, str(e)
+
+
+def _claim_previous(previous, rows, invalid):
+    """Match each row to at most one document of the previous run, returning ({index: (digest, entry)}, by_input).
+
+    A row is matched by its input hash first, preferring the file at its
+    own position so duplicate and moved rows each find their own, then by
+    its row position, so a corrected row is still recognised. by_input holds
+    the indices matched by input hash.
+    """
+    unclaimed = [(digest, entry) for digest, entries in previous.items() for entry in entries]
+    claims = {}
+    by_input = set()
+
+    def claim(index, match):
+        for item in unclaimed:
+            if match(*item):
+                unclaimed.remove(item)
+                claims[index] = item
+                return True
+        return False
+
+    for same_position in (True, False):
+        for index, digest, name, _ in rows:
+            if index not in claims and claim(index, lambda d, entry: d == digest and (
+                    entry["file"] == name or not same_position)):
+                by_input.add(index)
+    # Manifests from before entries recorded their index only know the position through the file name
+    positions = [(index, output_filename(index, record) if isinstance(record, dict) else None)
+                 for index, _, _, record in rows] + [(index, None) for index in invalid]
+    for index, name in positions:
+        if index not in claims:
+            claim(index, lambda d, entry: entry.get("index") == index or (
+                "index" not in entry and entry["file"] == name))
+    return claims, by_input
+
+
+def run_batch(records, output_dir, workers=None, subset='document', background_dpi=DEFAULT_DPI,
+              template=DEFAULT_TEMPLATE, compression=None, archived=False, incremental=True):
+    """Render records in parallel, returning (results, elapsed seconds, skipped count, removed files).
+
+    The output directory's manifest maps each record's input hash, together
+    with the template, font and image versions, to the file it produced. An
+    incremental run keeps every file whose record and resources are
+    unchanged and renders only new or changed rows; a non-incremental run
+    renders every row. Either way a row keeps the file name and reference
+    number it was issued before, matched by its input or else by its
+    position, and a row that now fails keeps its last good file. Files of
+    the previous run that no row produces any more are removed.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    records = list(records)
+    # Rows that would fail are reported before any worker starts
+    report = validate_records(records, template)
+    results = [(index, None, report.message(index)) for index in sorted(report.errors)]
+    rows = [
+        (index, canonical_hash(record), output_filename(index, record), dict(record))
+        for index, record in enumerate(records, start=1) if index not in report
+    ]
+    image_store.configure(dpi=background_dpi)
+    versions = DocumentGenerator.resource_versions(template, subset, compression)
+    build = canonical_hash(versions)
+    # Read even when not incremental: file names and reference numbers are carried over from it
+    previous = load_manifest(output_dir)
+    claims, by_input = _claim_previous(previous, rows, sorted(report.errors))
+
+    documents = {}
+    kept = set()
+    for index, digest, name, record in rows:
+        if incremental and index in by_input:
+            entry = claims[index][1]
+            if entry.get("build") == build and os.path.exists(os.path.join(output_dir, entry["file"])):
+                kept.add(index)
+                documents.setdefault(digest, []).append(dict(entry, index=index))
+                results.append((index, os.path.join(output_dir, entry["file"]), None))
+    skipped = len(kept)
+
+    # Rows matched by input keep their file; any other row must not take a file claimed by another one
+    taken = {entry["file"] for index, (_, entry) in claims.items() if index in by_input}
+    pending = []
+    for index, digest, name, record in rows:
+        if index in kept:
+            continue
+        issued = claims[index][1] if index in claims else {}
+        if index in by_input:
+            name = issued["file"]
+        elif name in taken:
+            name = f"{name[:-4]}_{digest[:8]}.pdf"
+        sequence = str(record.get("ref_sequence") or "").strip()
+        ref_number = issued.get("ref_number")
+        # A hand-entered sequence is only carried over while it is still the one that was issued
+        if not record.get("ref_number") and ref_number and (
+                not sequence or ref_number.endswith(f"/{int(sequence):03d}")):
+            record["ref_number"] = ref_number
+        pending.append((index, digest, name, record))
+    assign_refs([record for _, _, _, record in pending])
+    resolved = []
+    for row in pending:
+        record = row[3]
+        # Hand-entered sequences are resolved here too, so the manifest knows every document's number
+        if not record.get("ref_number"):
+            try:
+                record["ref_number"] = allocator.ref_for(record.get("ref_sequence"))
+            except RefError as e:
+                results.append((row[0], None, str(e)))
+                continue
+        resolved.append(row)
+    pending = resolved
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(background_dpi, template, subset, compression)) as pool:
+            futures = {
+                pool.submit(render_record, index, record, output_dir, subset, template, compression, archived,
+                            name): (index, digest, name, record)
+                for index, digest, name, record in pending
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if result[2] is None:
+                    index, digest, name, record = futures[future]
+                    documents.setdefault(digest, []).append(
+                        {"file": name, "build": build, "ref_number": record["ref_number"], "index": index})
+
+    # A row that fails now keeps the last good document it produced
+    current = {entry["file"] for entries in documents.values() for entry in entries}
+    for index, path, error in results:
+        if error and index in claims:
+            digest, entry = claims[index]
+            if entry["file"] not in current and os.path.exists(os.path.join(output_dir, entry["file"])):
+                documents.setdefault(digest, []).append(dict(entry, index=index))
+                current.add(entry["file"])
+    save_manifest(output_dir, documents, versions)
+
+    # Files of deleted rows, and those replaced under a new name, would otherwise linger
+    removed = 0
+    for name in {entry["file"] for entries in previous.values() for entry in entries} - current:
+        if os.path.basename(name) != name:
+            continue
+        try:
+            os.unlink(os.path.join(output_dir, name))
+            removed += 1
+        except OSError:
+            pass
+    results.sort()
+    return results, time.perf_counter() - start, skipped, removed
+
+
+def run_bundle(records, path, subset='document', background_dpi=DEFAULT_DPI, template=DEFAULT_TEMPLATE,
+               compression=None):
+    """Render records into a single PDF at path, returning (results, elapsed seconds)"""
+    start = time.perf_counter()
+    image_store.configure(dpi=background_dpi)
+    records = list(records)
+    report = validate_records(records, template)
+    results = [(index, None, report.message(index)) for index in sorted(report.errors)]
+    valid = [(index, dict(record)) for index, record in enumerate(records, start=1) if index not in report]
+    assign_refs([record for _, record in valid])
+    documents = []
+    for index, record in valid:
+        try:
+            documents.append((index, normalize_record(record)))
+        except Exception as e:
+            results.append((index, None, str(e)))
+    if documents:
+        with instrumentation.request("bundle"):
+            try:
+                pdf, failures = DocumentGenerator.create_bundle(
+                    [data for _, data in documents], subset=subset, template=template, compression=compression)
+                with open(path, 'wb') as f:
+                    pdf.output_to(f)
+            except Exception as e:
+                failures = [(position, str(e)) for position in range(1, len(documents) + 1)]
+        errors = {documents[position - 1][0]: error for position, error in failures}
+        results.extend((index, None if index in errors else path, errors.get(index)) for index, _ in documents)
+    results.sort()
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SLA documents in bulk from CSV or JSONL input")
+    parser.add_argument("input", help="CSV or JSONL file with one client record per row")
+    parser.add_argument("-o", "--output-dir", default="output", help="directory for the generated PDFs")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--subset", choices=SUBSET_MODES, default="document",
+                        help="embed only the glyphs each document uses, or the shared Latin business subset")
+    parser.add_argument("--background-dpi", type=int, default=DEFAULT_DPI,
+                        help="resample images to this resolution (0 embeds the original files)")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE,
+                        help="template name in templates/ or path to a template file")
+    parser.add_argument("--compression", choices=[*COMPRESSION_LEVELS, *COMPRESSION_PROFILES], default="default",
+                        help="deflate level for page and font streams")
+    parser.add_argument("--archive", action="store_true", help="also store every generated PDF in the searchable archive")
+    parser.add_argument("--force", action="store_true",
+                        help="render every record, even those the output directory's manifest shows are up to date")
+    parser.add_argument("--bundle", metavar="PDF",
+                        help="render every record into this one PDF, with a bookmark per client, instead of one file each")
+    parser.add_argument("--zip", metavar="ZIP",
+                        help="stream every PDF into this ZIP archive with a manifest, rendering one record at a time")
+    parser.add_argument("--check", action="store_true", help="only validate the input and print a per-row error report")
+    args = parser.parse_args()
+    if args.bundle and args.zip:
+        parser.error("--bundle and --zip are alternative outputs")
+    if (args.bundle or args.zip) and args.archive:
+        parser.error("--archive stores one PDF file per document and cannot be combined with --bundle or --zip")
+
+    if args.check:
+        report = validate_records(read_records(args.input), args.template)
+        for line in report.lines():
+            print(line)
+        print(f"\n{report.rows - len(report)}/{report.rows} records are valid")
+        return 1 if report else 0
+
+    if args.zip:
+        # zip_export builds on this module, so it is imported on demand
+        from zip_export import export_zip
+
+        image_store.configure(dpi=args.background_dpi or None)
+        start = time.perf_counter()
+        csv_format = args.input.lower().endswith(".csv")
+        # Validate in a first pass over the file, then stream the records again into the archive
+        with open(args.input, newline="", encoding="utf-8") as f:
+            report = validate_records(parse_records(f, csv_format), args.template)
+        with open(args.input, newline="", encoding="utf-8") as f, open(args.zip, "wb") as sink:
+            records = parse_records(f, csv_format)
+            generated, failed = export_zip(records, sink, args.subset, args.template, args.compression, report)
+        elapsed = time.perf_counter() - start
+        rate = generated / elapsed if elapsed else 0.0
+        print(f"Wrote {generated}/{generated + failed} documents to {args.zip} in {elapsed:.2f}s ({rate:.1f} docs/sec)")
+        if failed:
+            print(f"See {args.zip}:manifest.jsonl for the {failed} failed records")
+        return 1 if failed else 0
+
+    records = read_records(args.input)
+    if args.bundle:
+        results, elapsed = run_bundle(records, args.bundle, args.subset, args.background_dpi or None,
+                                      args.template, args.compression)
+        skipped = removed = 0
+    else:
+        results, elapsed, skipped, removed = run_batch(records, args.output_dir, args.workers, args.subset,
+                                                       args.background_dpi or None, args.template,
+                                                       args.compression, args.archive, not args.force)
+
+    failures = [(index, error) for index, path, error in results if error]
+    for index, error in failures:
+        print(f"Record {index}: {error}")
+    generated = len(results) - len(failures) - skipped
+    rate = generated / elapsed if elapsed else 0.0
+    print(f"\nGenerated {generated}/{len(results)} documents in {elapsed:.2f}s ({rate:.1f} docs/sec)")
+    if skipped:
+        print(f"Kept {skipped} unchanged documents from the previous run")
+    if removed:
+        print(f"Removed {removed} documents of rows that are no longer in the input")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
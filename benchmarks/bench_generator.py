@@ -0,0 +1,271 @@
+"""Benchmark DocumentGenerator.create_pdf across document shapes.
+
+Drives the App.py agreement (generator.DocumentGenerator, which App.py
+imports) and the test.py letter with synthetic data, with and without the
+background and a logo, and with Calibri or the core fallback fonts. The
+app/*/draft cases render the same data as DraftTemplate previews. Each case
+runs in a fresh process so peak RSS is per case.
+
+    python benchmarks/bench_generator.py -n 50 -o results.json
+    python benchmarks/bench_generator.py -n 50 --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_VERSION = 1
+
+LONG_DESCRIPTION = (
+    "Wholesale and retail trade of general goods, including import, export, storage, "
+    "distribution and after-sales support for commercial and industrial clients. "
+) * 40
+
+
+def app_fixture(shape):
+    """Synthetic data dict for the App.py agreement"""
+    data = {
+        "current_date": "01/01/2025",
+        "agreement_date": "01/01/2025",
+        "ref_number": "BKR/VAT/2025/01/001",
+        "client_name": "Acme Trading W.L.L",
+        "commercial_registration_number": "123456-1",
+        "attention": "Jane Doe",
+        "email": "jane@example.com",
+        "bahraini_ownership": 51,
+        "gcc_ownership": 0,
+        "american_ownership": 0,
+        "foreign_ownership": 49,
+        "isic_code_1": "4690",
+        "activity_name_1": "Non-specialized wholesale trade",
+        "activity_desc_1": "General trading",
+        "isic_code_2": "6202",
+        "activity_name_2": "Computer consultancy",
+        "activity_desc_2": "IT consultancy",
+        "company_formation_cost": 300.0,
+        "desk_space_cost": 600.0,
+        "businessman_visa_cost": 250.0,
+        "misc_charges": 50.0,
+        "poa_cost": 25.0,
+        "estimation_charges": 10.0,
+        "labor_auth_cost": 100.0,
+        "social_insurance_cost": 30.0,
+        "free_advice_cost": 0.0,
+        "signatory_name": "Jane Doe",
+        "passport_number": "P1234567",
+        "vat_registration_fee": 150.0,
+        "consultancy_fee": 250.0,
+        "services": ["VAT Registration", "VAT Compliance"],
+        "advance_payment": 50,
+        "remaining_payment": 50,
+    }
+    if shape == "long_text":
+        data["activity_desc_1"] = LONG_DESCRIPTION
+        data["activity_desc_2"] = LONG_DESCRIPTION
+    elif shape == "many_services":
+        data["services"] = [f"Service line {i}: filing, reconciliation and advisory support" for i in range(300)]
+    return data
+
+
+def letter_fixture(shape):
+    """Synthetic data dict for the test.py letter"""
+    data = {
+        "current_date": "01/01/2025",
+        "ref_number": "BKR/VAT/2025/01/001",
+        "client_name": "Acme Trading W.L.L",
+        "commercial_registration_number": "123456-1",
+        "attention": "Jane Doe",
+        "email": "jane@example.com",
+        "vat_registration_fee": 150.0,
+        "consultancy_fee": 250.0,
+        "authorized_person_name": "Jane Doe",
+        "additional_services": ["VAT Registration with National Bureau of Revenue (NBR)"],
+        "payment_terms": {"advance": "50", "remaining": "50"},
+    }
+    if shape == "long_text":
+        data["additional_services"] = [LONG_DESCRIPTION]
+    elif shape == "many_services":
+        data["additional_services"] = [f"Service line {i}: filing, reconciliation and advisory support" for i in range(300)]
+    return data
+
+
+SHAPES = ("minimal", "long_text", "many_services")
+IMAGES = ("background", "none", "background+logo")
+
+
+def cases():
+    """All benchmark cases as (name, generator, shape, images, fonts)"""
+    for shape in SHAPES:
+        for images in IMAGES:
+            for fonts in ("core", "calibri"):
+                yield (f"app/{shape}/{images}/{fonts}", "app", shape, images, fonts)
+            yield (f"letter/{shape}/{images}/calibri", "letter", shape, images, "calibri")
+        yield (f"app/{shape}/draft", "app", shape, "background", "draft")
+
+
+def _write_logo(path):
+    """Write a small RGB PNG to use as the logo"""
+    width, height = 300, 120
+    raw = b"".join(b"\x00" + bytes((0, 51, 102)) * width for _ in range(height))
+
+    def chunk(tag, payload):
+        return struct.pack(">I", len(payload)) + tag + payload + struct.pack(">I", zlib.crc32(tag + payload))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw)))
+        f.write(chunk(b"IEND", b""))
+
+
+@contextlib.contextmanager
+def _images(mode, tmpdir):
+    """Point the shared image store at the background/logo combination of a case"""
+    from image_resources import image_store
+
+    find = image_store.find
+    logo = os.path.join(tmpdir, "logo.png")
+    if mode == "background+logo":
+        _write_logo(logo)
+
+    def patched(*names):
+        if "logo.png" in names:
+            return logo if mode == "background+logo" else None
+        return None if mode == "none" else find(*names)
+
+    image_store.find = patched
+    try:
+        yield
+    finally:
+        image_store.find = find
+
+
+def _render_function(generator, fonts):
+    if generator == "letter":
+        import test
+        return test.DocumentGenerator.create_pdf
+    from generator import DocumentGenerator, DraftTemplate
+    if fonts == "draft":
+        return lambda data: DocumentGenerator.create_pdf(data, template_class=DraftTemplate)
+    if fonts == "calibri":
+        def add_fonts(pdf, plan):
+            pdf.add_font('Arial', '', 'calibri.ttf', uni=True)
+            pdf.add_font('Arial', 'B', 'calibrib.ttf', uni=True)
+            pdf.add_font('Arial', 'I', 'calibrii.ttf', uni=True)
+            return 'Arial'
+    else:
+        def add_fonts(pdf, plan):
+            return 'Arial'
+    DocumentGenerator.add_fonts = staticmethod(add_fonts)
+    return DocumentGenerator.create_pdf
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_case(case, rounds, warmup):
+    """Run one case in the current process and return its metrics"""
+    name, generator, shape, images, fonts = case
+    data = (letter_fixture if generator == "letter" else app_fixture)(shape)
+    create_pdf = _render_function(generator, fonts)
+    with tempfile.TemporaryDirectory() as tmpdir, _images(images, tmpdir), \
+            contextlib.redirect_stdout(io.StringIO()):
+        timings = []
+        for i in range(warmup + rounds):
+            start = time.perf_counter()
+            pdf = create_pdf(data)
+            sink = io.BytesIO()
+            pdf.output_to(sink)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                timings.append(elapsed)
+    total = sum(timings)
+    return {
+        "case": name,
+        "rounds": rounds,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p90_ms": percentile(timings, 90) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "mean_ms": total / rounds * 1000,
+        "pages": pdf.page,
+        "bytes": sink.tell(),
+        "pages_per_sec": pdf.page * rounds / total if total else 0.0,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print per-case deltas against a baseline run; return the regressed cases"""
+    previous = {row["case"]: row for row in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<44} {'p50 ms':>9} {'delta':>8} {'bytes':>9} {'delta':>8}")
+    for row in results:
+        old = previous.get(row["case"])
+        if old is None:
+            continue
+        latency = row["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+        size = row["bytes"] / old["bytes"] - 1 if old["bytes"] else 0.0
+        flag = "  REGRESSION" if latency > threshold or size > threshold else ""
+        if flag:
+            regressions.append(row["case"])
+        print(f"{row['case']:<44} {row['p50_ms']:>9.2f} {latency:>+8.1%} {row['bytes']:>9} {size:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DocumentGenerator.create_pdf across document shapes")
+    parser.add_argument("-n", "--rounds", type=int, default=30, help="measured renders per case")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured renders per case")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("-o", "--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="compare against a previous JSON results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown or growth reported as a regression")
+    args = parser.parse_args()
+
+    selected = [case for case in cases() if args.filter in case[0]]
+    results = []
+    print(f"{'case':<44} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'pages/s':>8} {'KB':>7} {'RSS MB':>7}")
+    for case in selected:
+        # A fresh process per case keeps caches and peak RSS independent
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            row = pool.submit(run_case, case, args.rounds, args.warmup).result()
+        results.append(row)
+        print(f"{row['case']:<44} {row['p50_ms']:>8.2f} {row['p90_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+              f"{row['pages_per_sec']:>8.1f} {row['bytes'] / 1024:>7.1f} {row['peak_rss_kb'] / 1024:>7.1f}")
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "rounds": args.rounds,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
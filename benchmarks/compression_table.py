@@ -0,0 +1,65 @@
+"""Size vs time trade-off of the stream compression levels.
+
+Renders a short agreement, a long letter and a long agreement once per
+compression level and times serialization (output_to) separately from
+layout, so the table shows what each level costs at output time and what
+it saves on disk.
+
+    python benchmarks/compression_table.py [-n ROUNDS]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_generator import app_fixture, letter_fixture
+from compression import COMPRESSION_LEVELS
+from generator import DocumentGenerator
+
+DOCUMENTS = (
+    ("agreement", "agreement", app_fixture("minimal")),
+    ("letter, many services", "letter", letter_fixture("many_services")),
+    ("agreement, long", "agreement", dict(app_fixture("many_services"), activity_desc_1=app_fixture("long_text")["activity_desc_1"])),
+)
+
+
+def measure(template, data, compression, rounds):
+    """Median serialization seconds, output bytes and pages for one level"""
+    timings = []
+    for _ in range(rounds):
+        pdf = DocumentGenerator.create_pdf(data, template=template, compression=compression)
+        sink = io.BytesIO()
+        start = time.perf_counter()
+        pdf.output_to(sink)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), sink.tell(), pdf.page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'document':<24} {'level':<8} {'pages':>5} {'size (KB)':>10} {'vs default':>11} {'output (ms)':>12}")
+    # Keep font fallback warnings out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = []
+        for name, template, data in DOCUMENTS:
+            # Warm the font, image and subset caches for every level first
+            for level in COMPRESSION_LEVELS:
+                measure(template, data, level, 1)
+            baseline = None
+            for level in COMPRESSION_LEVELS:
+                seconds, size, pages = measure(template, data, level, args.rounds)
+                baseline = baseline or size
+                rows.append(f"{name:<24} {level:<8} {pages:>5} {size / 1024:>10.1f} {size / baseline:>10.0%} {seconds * 1000:>12.2f}")
+    print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Render time against page count for agreements with a long annex.
+
+Renders the App.py agreement with a service schedule annex sized to reach
+each target page count, and reports the median time per document and per
+page. The last column is the cost of each page added since the previous
+size; linear scaling shows up as that column staying flat.
+
+    python benchmarks/long_document.py [-n ROUNDS] [--pages 10 50 100 250 500]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_generator import app_fixture
+from generator import DocumentGenerator
+
+# Annex rows that fit on one page at the template's 6 mm row height
+ROWS_PER_PAGE = 35
+
+
+def schedule(rows):
+    """Synthetic service schedule annex"""
+    frequencies = ("Monthly", "Quarterly", "Annually", "On request")
+    return [
+        {"service": f"VAT return preparation and filing, entity {i}", "frequency": frequencies[i % 4],
+         "fee": 25.0 + i % 40}
+        for i in range(rows)
+    ]
+
+
+def measure(data, rounds):
+    """Median seconds for create_pdf plus output_to, and the page count"""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        pdf = DocumentGenerator.create_pdf(data)
+        pdf.output_to(io.BytesIO())
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), pdf.page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--rounds", type=int, default=5)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    args = parser.parse_args()
+
+    print(f"{'annex rows':>10} {'pages':>6} {'total (ms)':>11} {'ms/page':>8} {'ms/added page':>14}")
+    # Keep font fallback warnings out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Warm the font, image and template caches
+        measure(dict(app_fixture("minimal"), service_schedule=schedule(ROWS_PER_PAGE)), 1)
+        rows = []
+        previous = None
+        for target in sorted(args.pages):
+            annex_rows = max(target - 2, 1) * ROWS_PER_PAGE
+            seconds, pages = measure(dict(app_fixture("minimal"), service_schedule=schedule(annex_rows)), args.rounds)
+            added = "" if previous is None else f"{(seconds - previous[0]) * 1000 / (pages - previous[1]):.3f}"
+            previous = (seconds, pages)
+            rows.append(f"{annex_rows:>10} {pages:>6} {seconds * 1000:>11.1f} {seconds * 1000 / pages:>8.3f} {added:>14}")
+    print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    main()
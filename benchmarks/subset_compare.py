@@ -0,0 +1,88 @@
+"""Compare PDF size and output time of the font subsetting modes.
+
+Renders the Calibri letter (templates/letter.json, as used by test.py) with the stock fpdf font
+embedding, the per-document glyph subset and the shared Latin business
+subset, and prints a comparison table.
+
+    python benchmarks/subset_compare.py [-n ROUNDS]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+
+from generator import DocumentGenerator, SLATemplate
+from subsetting import subset_cache
+
+SAMPLE = {
+    "current_date": "01/01/2025",
+    "ref_number": "BKR/VAT/2025/01/001",
+    "client_name": "Acme Trading W.L.L",
+    "commercial_registration_number": "123456-1",
+    "attention": "Jane Doe",
+    "email": "jane@example.com",
+    "vat_registration_fee": 150.0,
+    "consultancy_fee": 250.0,
+    "authorized_person_name": "Jane Doe",
+    "additional_services": [
+        "VAT Registration with National Bureau of Revenue (NBR)",
+        "VAT Compliance and Advisory Services",
+        "Support during VAT Registration Process",
+    ],
+    "payment_terms": {"advance": "50", "remaining": "50"},
+}
+
+
+class StockTemplate(SLATemplate):
+    """Embeds fonts through fpdf's own _putfonts, as before subsetting"""
+
+    def _putfonts(self):
+        for font in self.fonts.values():
+            if font['type'] == 'TTF':
+                font['subset'] = [0] + [code for code in font['subset'] if code]
+        FPDF._putfonts(self)
+
+
+class LatinTemplate(SLATemplate):
+    SUBSET = 'latin'
+
+
+VARIANTS = (
+    ("stock fpdf", StockTemplate),
+    ("document subset", SLATemplate),
+    ("latin subset", LatinTemplate),
+)
+
+
+def measure(template, rounds):
+    """Render SAMPLE with a template class, returning (bytes, first and median output seconds)"""
+    subset_cache.clear()
+    timings = []
+    for _ in range(rounds):
+        pdf = DocumentGenerator.create_pdf(SAMPLE, template='letter', template_class=template)
+        start = time.perf_counter()
+        buffer = pdf.output(dest='S')
+        timings.append(time.perf_counter() - start)
+    return len(buffer), timings[0], statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'variant':<18} {'size (KB)':>10} {'vs stock':>9} {'first (ms)':>11} {'median (ms)':>12}")
+    for name, template in VARIANTS:
+        size, first, median = measure(template, args.rounds)
+        baseline = baseline or size
+        print(f"{name:<18} {size / 1024:>10.1f} {size / baseline:>8.0%} {first * 1000:>11.1f} {median * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
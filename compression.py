@@ -0,0 +1,66 @@
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Deflate level for page content and embedded font streams. 'default' is
+# zlib's own default and matches what fpdf writes; 'off' stores streams raw.
+COMPRESSION_LEVELS = {
+    'default': zlib.Z_DEFAULT_COMPRESSION,
+    'off': None,
+    'fast': 1,
+    'max': 9,
+}
+
+# Named profiles: quick to produce for previews, smallest for archiving
+COMPRESSION_PROFILES = {
+    'preview': 'fast',
+    'archive': 'max',
+}
+
+# Documents with at least this many pages compress their pages across threads
+PARALLEL_PAGES = 8
+MAX_THREADS = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def compression_level(name):
+    """Resolve a compression name or profile to a zlib level, None meaning uncompressed"""
+    name = COMPRESSION_PROFILES.get(name, name)
+    if name not in COMPRESSION_LEVELS:
+        raise ValueError(f"Unknown compression: {name}")
+    return COMPRESSION_LEVELS[name]
+
+
+def _thread_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix='deflate')
+    return _pool
+
+
+def parallel(count):
+    """Whether count page streams are worth compressing across threads"""
+    return count >= PARALLEL_PAGES and MAX_THREADS >= 2
+
+
+def compress(chunk, level):
+    """Deflate one byte string, or return it as is when level is None"""
+    return chunk if level is None else zlib.compress(chunk, level)
+
+
+def compress_all(chunks, level):
+    """Deflate a list of byte strings, across threads when there are many.
+
+    zlib releases the GIL while it compresses, so page streams of a long
+    document compress in parallel within a single process.
+    """
+    if level is None:
+        return chunks
+    if not parallel(len(chunks)):
+        return [zlib.compress(chunk, level) for chunk in chunks]
+    return list(_thread_pool().map(zlib.compress, chunks, [level] * len(chunks)))
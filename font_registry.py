@@ -0,0 +1,173 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+
+from fpdf.ttfonts import TTFontFile
+
+from subsetting import GlyphSubset
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bump when the layout of the on-disk cache changes
+FONT_CACHE_VERSION = 1
+FONT_CACHE_DIR = os.path.join(BASE_DIR, '.font_cache')
+
+
+def resolve_font_file(fname):
+    """Find a font file, matching the file name case-insensitively next to this module"""
+    if os.path.exists(fname):
+        return fname
+    directory = os.path.join(BASE_DIR, os.path.dirname(fname))
+    wanted = os.path.basename(fname).lower()
+    try:
+        for entry in os.listdir(directory):
+            if entry.lower() == wanted:
+                return os.path.join(directory, entry)
+    except OSError:
+        pass
+    return None
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FontRegistry:
+    """Parses each TrueType face once per process and shares its metrics.
+
+    Parsed metrics are also stored in a versioned on-disk cache keyed by the
+    hash of the font file: a JSON header plus a raw array of character widths
+    that is memory-mapped on load instead of being unpickled.
+    """
+
+    def __init__(self, cache_dir=FONT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._faces = {}
+        self._lock = threading.Lock()
+
+    def get(self, fname):
+        """Return the parsed metrics of a font file, loading them on first use"""
+        face = self._faces.get(fname)
+        if face is None:
+            with self._lock:
+                face = self._faces.get(fname)
+                if face is None:
+                    face = self._load(fname)
+                    self._faces[fname] = face
+        return face
+
+    def register(self, pdf, family, style, fname):
+        """Register a unicode font on an FPDF instance using the shared metrics"""
+        family = family.lower()
+        if family == 'arial':
+            family = 'helvetica'
+        style = style.upper()
+        if style == 'IB':
+            style = 'BI'
+        fontkey = family + style
+        if fontkey in pdf.fonts:
+            return
+        face = self.get(fname)
+        if hasattr(pdf, 'str_alias_nb_pages'):
+            subset = GlyphSubset(range(0, 57))  # include numbers in the subset!
+        else:
+            subset = GlyphSubset(range(0, 32))
+        pdf.fonts[fontkey] = {
+            'i': len(pdf.fonts) + 1, 'type': 'TTF',
+            'name': face['name'], 'desc': face['desc'],
+            'up': face['up'], 'ut': face['ut'],
+            'cw': face['cw'],
+            'ttffile': face['ttffile'], 'fontkey': fontkey,
+            'subset': subset, 'unifilename': None,
+        }
+        pdf.font_files[fontkey] = {'length1': face['originalsize'], 'type': "TTF", 'ttffile': face['ttffile']}
+        pdf.font_files[fname] = {'type': "TTF"}
+
+    def _paths(self, digest):
+        stem = os.path.join(self.cache_dir, f"{digest}.v{FONT_CACHE_VERSION}")
+        return stem + '.json', stem + '.cw'
+
+    def _load(self, fname):
+        ttffile = resolve_font_file(fname)
+        if ttffile is None:
+            raise RuntimeError("TTF Font file not found: %s" % fname)
+        digest = file_hash(ttffile)
+        face = self._read_cache(digest)
+        if face is None:
+            face = self._parse(ttffile)
+            self._write_cache(digest, face)
+        face['ttffile'] = ttffile
+        return face
+
+    def _read_cache(self, digest):
+        meta_path, cw_path = self._paths(digest)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != FONT_CACHE_VERSION or meta.get('byteorder') != sys.byteorder:
+                return None
+            with open(cw_path, 'rb') as f:
+                widths = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        meta['cw'] = memoryview(widths).cast('H')
+        return meta
+
+    def _write_cache(self, digest, face):
+        meta_path, cw_path = self._paths(digest)
+        meta = {key: value for key, value in face.items() if key != 'cw'}
+        meta.update(version=FONT_CACHE_VERSION, byteorder=sys.byteorder)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write under temporary names so concurrent workers never see partial files
+            suffix = f".{os.getpid()}.tmp"
+            with open(cw_path + suffix, 'wb') as f:
+                face['cw'].tofile(f)
+            with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(cw_path + suffix, cw_path)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError as e:
+            print(f"Warning: Could not write font cache: {str(e)}")
+
+    @staticmethod
+    def _parse(ttffile):
+        ttf = TTFontFile()
+        ttf.getMetrics(ttffile)
+        desc = {
+            'Ascent': int(round(ttf.ascent, 0)),
+            'Descent': int(round(ttf.descent, 0)),
+            'CapHeight': int(round(ttf.capHeight, 0)),
+            'Flags': ttf.flags,
+            'FontBBox': "[%s %s %s %s]" % (
+                int(round(ttf.bbox[0], 0)),
+                int(round(ttf.bbox[1], 0)),
+                int(round(ttf.bbox[2], 0)),
+                int(round(ttf.bbox[3], 0))),
+            'ItalicAngle': int(ttf.italicAngle),
+            'StemV': int(round(ttf.stemV, 0)),
+            'MissingWidth': int(round(ttf.defaultWidth, 0)),
+        }
+        return {
+            'name': re.sub('[ ()]', '', ttf.fullName),
+            'type': 'TTF',
+            'desc': desc,
+            'up': round(ttf.underlinePosition),
+            'ut': round(ttf.underlineThickness),
+            'originalsize': os.stat(ttffile).st_size,
+            'cw': array('H', ttf.charWidths[:65536]),
+        }
+
+
+# Shared by every template in the process
+registry = FontRegistry()
@@ -0,0 +1,580 @@
+import math
+import os
+
+from fpdf import FPDF, FPDF_VERSION
+from compression import compress, compress_all, compression_level, parallel
+from font_registry import file_hash, registry, resolve_font_file
+from image_resources import draft_image_store, image_store
+from instrumentation import stage
+from layout import EMPTY_SKELETON, KEEP, RESET, string_width
+from subsetting import SUBSET_MODES, subset_cache, subset_codes
+from template_compiler import DEFAULT_TEMPLATE, compiler
+
+
+# Images placed by SLATemplate.header; the first existing file of each group is used
+BACKGROUND_FILES = ('background_template.jpg', 'background_template.png')
+LOGO_FILES = ('logo.png',)
+
+# Identity ToUnicode CMap shared by all embedded unicode fonts
+TO_UNICODE_CMAP = (
+    "/CIDInit /ProcSet findresource begin\n"
+    "12 dict begin\n"
+    "begincmap\n"
+    "/CIDSystemInfo\n"
+    "<</Registry (Adobe)\n"
+    "/Ordering (UCS)\n"
+    "/Supplement 0\n"
+    ">> def\n"
+    "/CMapName /Adobe-Identity-UCS def\n"
+    "/CMapType 2 def\n"
+    "1 begincodespacerange\n"
+    "<0000> <FFFF>\n"
+    "endcodespacerange\n"
+    "1 beginbfrange\n"
+    "<0000> <FFFF> <0000>\n"
+    "endbfrange\n"
+    "endcmap\n"
+    "CMapName currentdict /CMap defineresource pop\n"
+    "end\n"
+    "end"
+)
+
+
+class _SinkBuffer:
+    """Stands in for FPDF.buffer while streaming; len() is the byte offset fpdf uses for xref entries"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def write(self, s):
+        if isinstance(s, (bytes, bytearray)):
+            self.sink.write(s)
+            self.sink.write(b"\n")
+            self.size += len(s) + 1
+        else:
+            data = (str(s) + "\n").encode('latin1')
+            self.sink.write(data)
+            self.size += len(data)
+
+
+class SLATemplate(FPDF):
+    # Font family used by the header and footer; create_pdf sets the template's family
+    FONT = 'Arial'
+    # 'document' embeds only the glyphs used, 'latin' reuses the precomputed Latin business subset
+    SUBSET = 'document'
+    # Static text whose layout is shared by every document; create_pdf sets the template's skeleton
+    SKELETON = EMPTY_SKELETON
+    # Deflate level or profile for page and font streams, see compression.COMPRESSION_LEVELS
+    COMPRESSION = 'default'
+    # Store that decodes placed images, and the background files it looks for
+    IMAGES = image_store
+    BACKGROUND = BACKGROUND_FILES
+    # Render with the template's built-in fallback font instead of embedding its TrueType files
+    CORE_FONTS = False
+
+    def __init__(self, subset=None, compression=None):
+        super().__init__()
+        self.subset_mode = subset or self.SUBSET
+        if self.subset_mode not in SUBSET_MODES:
+            self.error('Unknown subset mode: ' + self.subset_mode)
+        try:
+            self.compress_level = compression_level(compression or self.COMPRESSION)
+        except ValueError as e:
+            self.error(str(e))
+        self.set_compression(self.compress_level is not None)
+        # Further increase margins to prevent overlapping
+        self.set_margins(left=25, top=55, right=25)  # Increased top margin
+        # Increase bottom margin significantly
+        self.set_auto_page_break(auto=True, margin=40)  # Increased bottom margin
+        # Set default line height
+        self.set_line_height(6.5)
+        # Outline (bookmark) entries as (title, page, y)
+        self.outlines = []
+
+    def set_line_height(self, height):
+        self.cell_height = height
+
+    def bookmark(self, title):
+        """Add an outline entry pointing at the current position"""
+        self.outlines.append((title, self.page, self.y))
+
+    def add_font(self, family, style='', fname='', uni=False):
+        # Unicode fonts come from the process-wide registry instead of being parsed per document
+        if not uni:
+            return super().add_font(family, style, fname, uni)
+        registry.register(self, family, style, fname)
+
+    def image(self, name, x=None, y=None, w=0, h=0, type='', link=''):
+        # Images are decoded and preprocessed once per process by the shared store
+        if name not in self.images:
+            self.images[name] = dict(self.IMAGES.get(name, w, h), i=len(self.images) + 1)
+        super().image(name, x, y, w, h, type, link)
+
+    def get_string_width(self, s):
+        # Summed from the font's width array in one pass rather than a dict lookup per character
+        return string_width(self.current_font, s) * self.font_size / 1000.0
+
+    def output_to(self, sink):
+        """Write the finished document straight into a binary file-like object.
+
+        Objects are streamed into the sink as they are serialized, so no full
+        copy of the document is held in memory. The document is consumed:
+        output() returns nothing afterwards.
+        """
+        if self.state == 3:
+            sink.write(self.buffer.encode('latin1'))
+            self.buffer = ''
+            return
+        self.buffer = _SinkBuffer(sink)
+        try:
+            self.close()
+        finally:
+            self.buffer = ''
+
+    def output_file(self, path):
+        """Write the finished document to path, which only ever holds a complete PDF.
+
+        The document is streamed into a temporary file next to path and moved
+        into place once it has been written; if serialization fails the
+        temporary file is removed and path is left untouched.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                self.output_to(f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _enddoc(self):
+        with stage('serialize'):
+            super()._enddoc()
+
+    def _out(self, s):
+        if self.state == 2:
+            # Page content is collected line by line and joined once when the page ends,
+            # rather than copying the page string on every line
+            if isinstance(s, bytes):
+                s = s.decode('latin1')
+            elif not isinstance(s, str):
+                s = str(s)
+            self.page_lines.append(s)
+        elif isinstance(self.buffer, _SinkBuffer):
+            # While streaming, document-level output goes straight into the sink
+            self.buffer.write(s)
+        else:
+            super()._out(s)
+
+    def _beginpage(self, orientation):
+        super()._beginpage(orientation)
+        self.page_lines = []
+
+    def _endpage(self):
+        if self.page_lines:
+            self.pages[self.page] += '\n'.join(self.page_lines) + '\n'
+            self.page_lines = []
+        super()._endpage()
+
+    def multi_cell(self, w, h, txt='', border=0, align='J', fill=0, split_only=False):
+        # Same output as fpdf's multi_cell, but static paragraphs reuse the skeleton's line breaks
+        if border or split_only or self.page == 0:
+            return super().multi_cell(w, h, txt, border, align, fill, split_only)
+        txt = self.normalize_text(txt)
+        if w == 0:
+            w = self.w - self.r_margin - self.x
+        wmax = (w - 2 * self.c_margin) * 1000.0 / self.font_size
+        s = txt.replace("\r", '')
+        if s.endswith("\n"):
+            s = s[:-1]
+        for paragraph in s.split("\n"):
+            for line, ws in self.SKELETON.layout(self, paragraph, wmax, align):
+                if ws is RESET:
+                    if self.ws > 0:
+                        self.ws = 0
+                        self._out('0 Tw')
+                elif ws is not KEEP:
+                    self.ws = ws
+                    self._out('%.3f Tw' % (ws * self.k))
+                self.cell(w, h, line, 0, 2, align, fill)
+        self.x = self.l_margin
+        return []
+
+    def _putpages(self):
+        # Links and page number aliases are not used by the templates; they take the stock path
+        if self.page_links or hasattr(self, 'str_alias_nb_pages'):
+            return super()._putpages()
+        nb = self.page
+        if self.def_orientation == 'P':
+            w_pt = self.fw_pt
+            h_pt = self.fh_pt
+        else:
+            w_pt = self.fh_pt
+            h_pt = self.fw_pt
+        # Long documents compress all their pages up front across threads; shorter
+        # ones compress each page as it is written, holding one stream at a time
+        streams = None
+        if parallel(nb):
+            streams = compress_all([self.pages[n].encode('latin1') for n in range(1, nb + 1)], self.compress_level)
+        filter = '/Filter /FlateDecode ' if self.compress else ''
+        for n in range(1, nb + 1):
+            # Page
+            self._newobj()
+            self._out('<</Type /Page')
+            self._out('/Parent 1 0 R')
+            if n in self.orientation_changes:
+                self._out('/MediaBox [0 0 %.2f %.2f]' % (h_pt, w_pt))
+            self._out('/Resources 2 0 R')
+            if self.pdf_version > '1.3':
+                self._out('/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>')
+            self._out('/Contents ' + str(self.n + 1) + ' 0 R>>')
+            self._out('endobj')
+            # Page content
+            if streams is None:
+                p = compress(self.pages[n].encode('latin1'), self.compress_level)
+            else:
+                p = streams[n - 1]
+            self._newobj()
+            self._out('<<' + filter + '/Length ' + str(len(p)) + '>>')
+            self._putstream(p)
+            self._out('endobj')
+        # Pages root
+        self.offsets[1] = len(self.buffer)
+        self._out('1 0 obj')
+        self._out('<</Type /Pages')
+        self._out('/Kids [' + ''.join(str(3 + 2 * i) + ' 0 R ' for i in range(nb)) + ']')
+        self._out('/Count ' + str(nb))
+        self._out('/MediaBox [0 0 %.2f %.2f]' % (w_pt, h_pt))
+        self._out('>>')
+        self._out('endobj')
+
+    def _putresources(self):
+        super()._putresources()
+        if self.outlines:
+            self._putoutlines()
+
+    def _putoutlines(self):
+        # A flat outline: the root, then one entry per bookmark linked to its neighbours
+        self.outline_root = self.n + 1
+        first = self.outline_root + 1
+        last = self.outline_root + len(self.outlines)
+        self._newobj()
+        self._out('<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>' % (first, last, len(self.outlines)))
+        self._out('endobj')
+        for n, (title, page, y) in enumerate(self.outlines, start=first):
+            self._newobj()
+            self._out('<</Title ' + self._outline_title(title))
+            self._out('/Parent %d 0 R' % self.outline_root)
+            if n > first:
+                self._out('/Prev %d 0 R' % (n - 1))
+            if n < last:
+                self._out('/Next %d 0 R' % (n + 1))
+            # Page objects are written first, two objects per page starting at 3
+            self._out('/Dest [%d 0 R /XYZ 0 %.2f null]>>' % (3 + 2 * (page - 1), (self.h - y) * self.k))
+            self._out('endobj')
+
+    def _outline_title(self, title):
+        try:
+            title.encode('latin1')
+            return self._textstring(title)
+        except UnicodeEncodeError:
+            # Titles outside Latin-1 are written as UTF-16BE with a byte order mark
+            return self._textstring('\xfe\xff' + title.encode('utf-16-be').decode('latin1'))
+
+    def _putcatalog(self):
+        super()._putcatalog()
+        if self.outlines:
+            self._out('/Outlines %d 0 R' % self.outline_root)
+            self._out('/PageMode /UseOutlines')
+
+    def _putfonts(self):
+        # Only core and unicode TrueType fonts are used by the templates; anything else takes the stock path
+        if self.diffs or any(font['type'] not in ('core', 'TTF') for font in self.fonts.values()):
+            return super()._putfonts()
+        for idx, k, font in sorted((font['i'], k, font) for k, font in self.fonts.items()):
+            self.fonts[k]['n'] = self.n + 1
+            name = font['name']
+            if font['type'] == 'core':
+                # Standard font
+                self._newobj()
+                self._out('<</Type /Font')
+                self._out('/BaseFont /' + name)
+                self._out('/Subtype /Type1')
+                if name != 'Symbol' and name != 'ZapfDingbats':
+                    self._out('/Encoding /WinAnsiEncoding')
+                self._out('>>')
+                self._out('endobj')
+                continue
+
+            # Embedded glyph subset, built once per face and set of code points
+            subset = subset_cache.get(font, subset_codes(font, self.subset_mode), self.compress_level)
+            fontname = 'MPDFAA' + '+' + name
+
+            # Type0 Font
+            self._newobj()
+            self._out('<</Type /Font')
+            self._out('/Subtype /Type0')
+            self._out('/BaseFont /' + fontname)
+            self._out('/Encoding /Identity-H')
+            self._out('/DescendantFonts [' + str(self.n + 1) + ' 0 R]')
+            self._out('/ToUnicode ' + str(self.n + 2) + ' 0 R')
+            self._out('>>')
+            self._out('endobj')
+
+            # CIDFontType2
+            self._newobj()
+            self._out('<</Type /Font')
+            self._out('/Subtype /CIDFontType2')
+            self._out('/BaseFont /' + fontname)
+            self._out('/CIDSystemInfo ' + str(self.n + 2) + ' 0 R')
+            self._out('/FontDescriptor ' + str(self.n + 3) + ' 0 R')
+            if font['desc'].get('MissingWidth'):
+                self._out('/DW %d' % font['desc']['MissingWidth'])
+            self._out(subset['widths'])
+            self._out('/CIDToGIDMap ' + str(self.n + 4) + ' 0 R')
+            self._out('>>')
+            self._out('endobj')
+
+            # ToUnicode
+            self._newobj()
+            self._out('<</Length ' + str(len(TO_UNICODE_CMAP)) + '>>')
+            self._putstream(TO_UNICODE_CMAP)
+            self._out('endobj')
+
+            # CIDSystemInfo dictionary
+            self._newobj()
+            self._out('<</Registry (Adobe)')
+            self._out('/Ordering (UCS)')
+            self._out('/Supplement 0')
+            self._out('>>')
+            self._out('endobj')
+
+            # Font descriptor
+            self._newobj()
+            self._out('<</Type /FontDescriptor')
+            self._out('/FontName /' + fontname)
+            for kd in ('Ascent', 'Descent', 'CapHeight', 'Flags', 'FontBBox', 'ItalicAngle', 'StemV', 'MissingWidth'):
+                v = font['desc'][kd]
+                if kd == 'Flags':
+                    v = v | 4
+                    v = v & ~32  # SYMBOLIC font flag
+                self._out(' /%s %s' % (kd, v))
+            self._out('/FontFile2 ' + str(self.n + 2) + ' 0 R')
+            self._out('>>')
+            self._out('endobj')
+
+            # CIDToGIDMap
+            self._newobj()
+            self._out('<</Length ' + str(len(subset['cidtogidmap'])))
+            if self.compress:
+                self._out('/Filter /FlateDecode')
+            self._out('>>')
+            self._putstream(subset['cidtogidmap'])
+            self._out('endobj')
+
+            # Font file
+            self._newobj()
+            self._out('<</Length ' + str(len(subset['fontstream'])))
+            if self.compress:
+                self._out('/Filter /FlateDecode')
+            self._out('/Length1 ' + str(subset['length1']))
+            self._out('>>')
+            self._putstream(subset['fontstream'])
+            self._out('endobj')
+
+    def header(self):
+        with stage('header'):
+            # Add background template if exists
+            background = self.BACKGROUND and self.IMAGES.find(*self.BACKGROUND)
+            if background:
+                with stage('header.image'):
+                    self.image(background, x=0, y=0, w=210, h=297)  # A4 size
+
+            # Move header up - start at y=10
+            self.set_y(10)
+
+            # Logo placeholder (left side) with adjusted position
+            logo = self.IMAGES.find(*LOGO_FILES)
+            if logo:
+                with stage('header.image'):
+                    self.image(logo, x=25, y=10, w=30)
+
+            # Title (center) with increased spacing
+            self.set_font(self.FONT, 'B', 14)
+            self.set_text_color(0, 51, 102)
+            self.cell(0, 12, 'SERVICE LEVEL AGREEMENT', 0, 1, 'C')
+
+            # Reset text color for content
+            self.set_text_color(0, 0, 0)
+
+            # Reset to content start position - moved up
+            self.set_y(40)  # Start content higher
+
+    def footer(self):
+        with stage('footer'):
+            # Move footer text to the very bottom of the page
+            self.set_y(-15)  # -15 is the absolute bottom position
+            self.set_font(self.FONT, 'I', 8)
+            self.set_text_color(0, 51, 102)
+            self.cell(0, 10, 'B.K.R Support Services W.L.L', 0, 0, 'C')
+            self.set_text_color(0, 0, 0)
+
+
+class DraftTemplate(SLATemplate):
+    """A quick preview render: core fonts, a low-resolution background and a DRAFT mark on every page.
+
+    Meant for re-rendering while a form is still being edited; the document
+    that is downloaded or archived is always rendered with SLATemplate.
+    """
+    COMPRESSION = 'preview'
+    IMAGES = draft_image_store
+    # Without Pillow the background cannot be thumbnailed, so drafts leave it out
+    BACKGROUND = BACKGROUND_FILES if draft_image_store.resamples else ()
+    CORE_FONTS = True
+    MARK = 'DRAFT'
+    # Gray level of the mark, drawn behind the page content
+    MARK_GRAY = 0.85
+
+    def normalize_text(self, txt):
+        # Core fonts only cover Latin-1; anything else shows as '?' in a draft
+        if isinstance(txt, str):
+            return txt.encode('latin1', 'replace').decode('latin1')
+        return txt
+
+    def header(self):
+        super().header()
+        with stage('header.mark'):
+            family, style, size = self.font_family, self.font_style, self.font_size_pt
+            self.set_font(self.FONT, 'B', 96)
+            # Centred on the page and running along its diagonal
+            angle = math.atan2(self.h, self.w)
+            c, s = math.cos(angle), math.sin(angle)
+            width = self.get_string_width(self.MARK) * self.k
+            self._out('q %.3f g %.5f %.5f %.5f %.5f %.2f %.2f cm' % (
+                self.MARK_GRAY, c, s, -s, c, self.w / 2 * self.k, self.h / 2 * self.k))
+            self._out('BT %.2f %.2f Td (%s) Tj ET Q' % (
+                -width / 2, -self.font_size_pt * 0.35, self._escape(self.MARK)))
+            if family:
+                self.set_font(family, style, size)
+
+
+class DocumentGenerator:
+    @staticmethod
+    def load_resources(template=DEFAULT_TEMPLATE, subset=None, compression=None):
+        """Load fonts, the background and the template into the per-process caches"""
+        plan = compiler.load(template)
+        pdf = SLATemplate(subset=subset, compression=compression)
+        DocumentGenerator.add_fonts(pdf, plan)
+        pdf.add_page()
+        if pdf.subset_mode == 'latin':
+            # Every Latin document embeds the same subset, so it can be built ahead of the first request
+            for font in pdf.fonts.values():
+                if font['type'] == 'TTF':
+                    subset_cache.get(font, subset_codes(font, 'latin'), pdf.compress_level)
+
+    @staticmethod
+    def resource_versions(template=DEFAULT_TEMPLATE, subset=None, compression=None):
+        """Everything besides the data that a rendered document depends on, as a JSON-able dict"""
+        plan = compiler.load(template)
+        fonts = {}
+        for style, fname in sorted(plan.font_files.items()):
+            path = resolve_font_file(fname)
+            fonts[fname] = file_hash(path) if path else None
+        images = {}
+        for names in (BACKGROUND_FILES, LOGO_FILES):
+            path = image_store.find(*names)
+            if path:
+                images[os.path.basename(path)] = file_hash(path)
+        return {
+            'fpdf': FPDF_VERSION,
+            'template': plan.name,
+            'template_version': plan.version,
+            'template_digest': plan.digest,
+            'fonts': fonts,
+            'images': images,
+            'image_dpi': image_store.dpi,
+            'image_quality': image_store.quality,
+            'subset': subset or SLATemplate.SUBSET,
+            'compression': compression or SLATemplate.COMPRESSION,
+        }
+
+    @staticmethod
+    def add_fonts(pdf, plan):
+        """Register a template's fonts, returning the family to render with"""
+        if pdf.CORE_FONTS:
+            return plan.font_fallback
+        try:
+            for style, fname in plan.font_files.items():
+                pdf.add_font(plan.font_family, style, fname, uni=True)
+            return plan.font_family
+        except Exception as e:
+            print(f"Warning: Could not load {plan.font_family} fonts, falling back to {plan.font_fallback}: {str(e)}")
+            pdf.set_font(plan.font_fallback, '', 10)
+            return plan.font_fallback
+
+    @staticmethod
+    def create_pdf(data, subset=None, template=DEFAULT_TEMPLATE, template_class=SLATemplate, compression=None):
+        try:
+            plan = compiler.load(template)
+            pdf = template_class(subset=subset, compression=compression)
+            pdf.SKELETON = plan.skeleton
+            with stage('fonts'):
+                pdf.FONT = DocumentGenerator.add_fonts(pdf, plan)
+
+            pdf.add_page()
+
+            with stage('layout'):
+                plan.render(pdf, data, pdf.FONT)
+
+            return pdf
+
+        except Exception as e:
+            raise Exception(f"Error creating PDF: {str(e)}")
+
+    @staticmethod
+    def bundle_title(index, data):
+        """Outline entry for one document of a bundle"""
+        client = str(data.get('client_name') or '').strip() or f"Document {index}"
+        ref_number = str(data.get('ref_number') or '').strip()
+        return f"{client} ({ref_number})" if ref_number else client
+
+    @staticmethod
+    def create_bundle(records, subset=None, template=DEFAULT_TEMPLATE, template_class=SLATemplate, compression=None):
+        """Render many data dicts into one PDF, returning (pdf, [(index, error), ...]).
+
+        Every document starts on a new page and gets an outline entry; fonts
+        and images are embedded once and shared by all pages. A record whose
+        fields cannot be formatted is left out and reported instead.
+        """
+        try:
+            plan = compiler.load(template)
+            pdf = template_class(subset=subset, compression=compression)
+            pdf.SKELETON = plan.skeleton
+            with stage('fonts'):
+                pdf.FONT = DocumentGenerator.add_fonts(pdf, plan)
+
+            failures = []
+            for index, data in enumerate(records, start=1):
+                try:
+                    ops = plan.prepare(data)
+                except Exception as e:
+                    failures.append((index, str(e)))
+                    continue
+                pdf.add_page()
+                pdf.bookmark(DocumentGenerator.bundle_title(index, data))
+                with stage('layout'):
+                    plan.draw(pdf, ops, pdf.FONT)
+            if pdf.page == 0:
+                raise Exception("no record could be rendered")
+
+            return pdf, failures
+
+        except Exception as e:
+            raise Exception(f"Error creating PDF bundle: {str(e)}")
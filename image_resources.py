@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+
+from fpdf import FPDF
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_CACHE_DIR = os.path.join(BASE_DIR, '.image_cache')
+
+# Preprocessing applied to placed images: resample to this resolution for the
+# size they are drawn at and recompress JPEGs at this quality. A dpi of None
+# embeds the original files unchanged.
+DEFAULT_DPI = 150
+DEFAULT_QUALITY = 80
+# Draft previews only need the letterhead to be recognisable on screen
+DRAFT_DPI = 36
+DRAFT_QUALITY = 50
+
+
+class ImageStore:
+    """Loads, preprocesses and parses each image once per process.
+
+    Entries are keyed by file and placement size and hold the fpdf image info
+    dict, so every document and every page reuses the same decoded data.
+    Resampled files are also kept in an on-disk cache keyed by the hash of the
+    source image, letting other worker processes skip the resampling.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY):
+        self.cache_dir = cache_dir
+        self.dpi = dpi
+        self.quality = quality
+        self._images = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def configure(self, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY):
+        """Change the preprocessing settings, dropping previously loaded images"""
+        with self._lock:
+            self.dpi = dpi
+            self.quality = quality
+            self._images.clear()
+
+    @property
+    def resamples(self):
+        """Whether placed images are downsampled; without Pillow they are embedded as they are"""
+        return Image is not None and bool(self.dpi)
+
+    def find(self, *names):
+        """Return the path of the first existing resource file, or None"""
+        if names not in self._paths:
+            found = None
+            for name in names:
+                path = os.path.join(BASE_DIR, name)
+                if os.path.exists(path):
+                    found = path
+                    break
+            self._paths[names] = found
+        return self._paths[names]
+
+    def get(self, path, w=0, h=0):
+        """Return the fpdf image info for a file placed at w x h millimetres"""
+        key = (path, w, h)
+        info = self._images.get(key)
+        if info is None:
+            with self._lock:
+                info = self._images.get(key)
+                if info is None:
+                    info = self._parse(self._preprocess(path, w, h))
+                    self._images[key] = info
+        return info
+
+    def _preprocess(self, path, w, h):
+        if Image is None or not self.dpi or not (w or h):
+            return path
+        with Image.open(path) as im:
+            if not w:
+                w = h * im.width / im.height
+            if not h:
+                h = w * im.height / im.width
+            size = (round(w / 25.4 * self.dpi), round(h / 25.4 * self.dpi))
+            # Only ever downsample
+            if size[0] >= im.width or size[1] >= im.height:
+                return path
+            keep_alpha = im.mode in ('RGBA', 'LA', 'P')
+            ext = '.png' if keep_alpha else '.jpg'
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            target = os.path.join(
+                self.cache_dir, f"{digest}.{size[0]}x{size[1]}.q{self.quality}{ext}")
+            if os.path.exists(target):
+                return target
+            resized = im.convert('RGBA' if keep_alpha else 'RGB').resize(size, Image.LANCZOS)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{target}.{os.getpid()}.tmp"
+            if keep_alpha:
+                resized.save(tmp, 'PNG', optimize=True)
+            else:
+                resized.save(tmp, 'JPEG', quality=self.quality, optimize=True)
+            os.replace(tmp, target)
+        except OSError as e:
+            print(f"Warning: Could not write image cache: {str(e)}")
+            return path
+        return target
+
+    @staticmethod
+    def _parse(path):
+        parser = FPDF()
+        if path.lower().endswith('.png'):
+            return parser._parsepng(path)
+        return parser._parsejpg(path)
+
+
+# Shared by every template in the process
+image_store = ImageStore()
+# Shared by every draft template in the process
+draft_image_store = ImageStore(dpi=DRAFT_DPI, quality=DRAFT_QUALITY)
@@ -0,0 +1,178 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("sla.timing")
+
+_enabled = os.environ.get("SLA_TIMING", "").lower() in ("1", "true", "yes")
+_current = contextvars.ContextVar("sla_timing_profile", default=None)
+_NULL = contextlib.nullcontext()
+
+
+def _log_to_stderr():
+    """Let the JSON lines through at INFO, printing them on stderr unless logging is already configured"""
+    logger.setLevel(logging.INFO)
+    if logger.handlers or logging.getLogger().handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    # Configuring the root logger later must not print every line twice
+    logger.propagate = False
+
+
+def enable():
+    """Turn stage timing on for this process"""
+    global _enabled
+    _enabled = True
+    _log_to_stderr()
+
+
+def disable():
+    """Turn stage timing off for this process"""
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+if _enabled:
+    _log_to_stderr()
+
+
+class Profile:
+    """Exclusive time per pipeline stage for one rendered document.
+
+    Stages nest (a page break inside multi_cell runs header() and footer()),
+    so each stage records only the time not spent in its child stages and
+    the breakdown adds up to the total.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = {}
+        self.counts = {}
+        self.total = 0.0
+        self._stack = []
+
+    def breakdown(self):
+        """Stages ordered by time spent, as (stage, seconds, calls)"""
+        return sorted(
+            ((name, seconds, self.counts[name]) for name, seconds in self.stages.items()),
+            key=lambda item: item[1], reverse=True,
+        )
+
+    def as_dict(self):
+        return {
+            "label": self.label,
+            "total_ms": round(self.total * 1000, 3),
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "calls": dict(self.counts),
+        }
+
+
+class _Metrics:
+    """Process-wide totals for the Prometheus snapshot"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.calls = {}
+        self.documents = 0
+        self.document_seconds = 0.0
+
+    def add(self, profile):
+        with self.lock:
+            self.documents += 1
+            self.document_seconds += profile.total
+            for name, seconds in profile.stages.items():
+                self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+                self.calls[name] = self.calls.get(name, 0) + profile.counts[name]
+
+
+metrics = _Metrics()
+
+
+class _Stage:
+    __slots__ = ("profile", "name", "start", "children")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.profile._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profile = self.profile
+        profile._stack.pop()
+        if profile._stack:
+            profile._stack[-1].children += elapsed
+        profile.stages[self.name] = profile.stages.get(self.name, 0.0) + elapsed - self.children
+        profile.counts[self.name] = profile.counts.get(self.name, 0) + 1
+        return False
+
+
+def stage(name):
+    """Time a pipeline stage; a shared no-op context when timing is off or no request is active"""
+    if not _enabled:
+        return _NULL
+    profile = _current.get()
+    if profile is None:
+        return _NULL
+    return _Stage(profile, name)
+
+
+@contextlib.contextmanager
+def request(label="sla"):
+    """Collect the stage timings of one document and log them as a JSON line"""
+    if not _enabled:
+        yield None
+        return
+    profile = Profile(label)
+    token = _current.set(profile)
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.total = time.perf_counter() - start
+        _current.reset(token)
+        # Time outside any stage is reported as "other"
+        other = profile.total - sum(profile.stages.values())
+        if other > 0:
+            profile.stages["other"] = other
+            profile.counts["other"] = 1
+        metrics.add(profile)
+        logger.info(json.dumps(profile.as_dict()))
+
+
+def prometheus_snapshot():
+    """Process-wide stage totals in the Prometheus text exposition format"""
+    with metrics.lock:
+        lines = [
+            "# HELP sla_documents_total Documents rendered with timing enabled.",
+            "# TYPE sla_documents_total counter",
+            f"sla_documents_total {metrics.documents}",
+            "# HELP sla_document_seconds_total Wall time spent rendering documents.",
+            "# TYPE sla_document_seconds_total counter",
+            f"sla_document_seconds_total {metrics.document_seconds:.6f}",
+            "# HELP sla_stage_seconds_total Exclusive time spent in each pipeline stage.",
+            "# TYPE sla_stage_seconds_total counter",
+        ]
+        for name in sorted(metrics.seconds):
+            lines.append(f'sla_stage_seconds_total{{stage="{name}"}} {metrics.seconds[name]:.6f}')
+        lines.append("# HELP sla_stage_calls_total Number of times each pipeline stage ran.")
+        lines.append("# TYPE sla_stage_calls_total counter")
+        for name in sorted(metrics.calls):
+            lines.append(f'sla_stage_calls_total{{stage="{name}"}} {metrics.calls[name]}')
+    return "\n".join(lines) + "\n"
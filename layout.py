@@ -0,0 +1,147 @@
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
+# Line plan markers: a float sets the justification word spacing before the
+# line, RESET clears it and KEEP leaves it untouched (fpdf's multi_cell rules).
+RESET = None
+KEEP = 'keep'
+
+# Core font widths as arrays indexed by code point, built once per face
+_core_tables = {}
+
+
+def width_table(font):
+    """Character widths of a font as an array indexed by code point.
+
+    Unicode fonts from the registry already carry a memory-mapped array that
+    covers the BMP; core fonts get a 256-entry array built from fpdf's dict.
+    """
+    cw = font['cw']
+    if not isinstance(cw, dict):
+        return cw
+    key = (font['type'], font['name'])
+    table = _core_tables.get(key)
+    if table is None:
+        table = array('H', (cw.get(chr(code), 0) for code in range(256)))
+        _core_tables[key] = table
+    return table
+
+
+def char_widths(font, text):
+    """Width of every character of text in thousandths of the font size"""
+    table = width_table(font)
+    try:
+        # One C-level pass instead of a Python loop per character
+        return list(map(table.__getitem__, map(ord, text)))
+    except IndexError:
+        size = len(table)
+        if font['type'] == 'core':
+            missing = 0
+        else:
+            missing = font['desc'].get('MissingWidth') or 500
+        return [table[code] if code < size else missing for code in map(ord, text)]
+
+
+def string_width(font, text):
+    """Width of text in thousandths of the font size, as fpdf's get_string_width sums it"""
+    return sum(char_widths(font, text))
+
+
+def break_lines(pdf, paragraph, wmax, align):
+    """Split one paragraph into (text, spacing) lines the way fpdf's multi_cell does.
+
+    Widths are summed once into a running total, so each line end is found
+    with a binary search instead of by adding up one character at a time.
+    """
+    offsets = list(accumulate(char_widths(pdf.current_font, paragraph), initial=0))
+    lines = []
+    nb = len(paragraph)
+    j = 0
+    while True:
+        # First character whose right edge passes the available width
+        i = bisect_right(offsets, offsets[j] + wmax, j + 1) - 1
+        if i >= nb:
+            break
+        sep = paragraph.rfind(' ', j, i + 1)
+        if sep == -1:
+            if i == j:
+                i += 1
+            lines.append((paragraph[j:i], RESET))
+            j = i
+        else:
+            if align == 'J':
+                ns = paragraph.count(' ', j, sep + 1)
+                ls = offsets[sep] - offsets[j]
+                ws = (wmax - ls) / 1000.0 * pdf.font_size / (ns - 1) if ns > 1 else 0
+                lines.append((paragraph[j:sep], ws))
+            else:
+                lines.append((paragraph[j:sep], KEEP))
+            j = sep + 1
+    lines.append((paragraph[j:], RESET))
+    return lines
+
+
+class LineCache:
+    """Bounded LRU of line plans keyed by font, size, width, alignment and text"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def layout(self, pdf, paragraph, wmax, align):
+        key = (pdf.current_font['name'], pdf.font_size_pt, wmax, align, paragraph)
+        with self._lock:
+            lines = self._entries.get(key)
+            if lines is not None:
+                self._entries.move_to_end(key)
+                return lines
+        lines = break_lines(pdf, paragraph, wmax, align)
+        with self._lock:
+            self._entries[key] = lines
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return lines
+
+
+# Line plans of data-dependent paragraphs, shared by every template in the process
+line_cache = LineCache()
+
+
+class TemplateSkeleton:
+    """The static text of one template version, laid out once per process.
+
+    Paragraphs that contain no data fields have the same line breaks in every
+    document, so their layout is computed on first use for a given font, size
+    and width and then reused. Paragraphs with data fields are laid out per
+    document.
+    """
+
+    def __init__(self, version, blocks=()):
+        self.version = version
+        self.paragraphs = frozenset(p for block in blocks for p in block.split('\n'))
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def layout(self, pdf, paragraph, wmax, align):
+        """Line plan for a paragraph in the current font"""
+        if paragraph not in self.paragraphs:
+            return line_cache.layout(pdf, paragraph, wmax, align)
+        key = (self.version, pdf.current_font['name'], pdf.font_size_pt, wmax, align, paragraph)
+        lines = self._layouts.get(key)
+        if lines is None:
+            lines = break_lines(pdf, paragraph, wmax, align)
+            with self._lock:
+                self._layouts[key] = lines
+        return lines
+
+
+# Skeleton with no static text, used by templates that do not define one
+EMPTY_SKELETON = TemplateSkeleton(0)
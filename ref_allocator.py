@@ -0,0 +1,149 @@
+import datetime
+import os
+import sqlite3
+
+from sqlite_db import LocalConnection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REF_DB_PATH = os.environ.get("SLA_REF_DB", os.path.join(BASE_DIR, "references.db"))
+
+REF_PREFIX = "BKR/VAT"
+# Sequences are printed with three digits, so a month has at most this many references
+MAX_SEQUENCE = 999
+
+
+def format_ref(year, month, sequence):
+    """Reference number in the BKR/VAT/YYYY/MM/NNN form"""
+    return f"{REF_PREFIX}/{year}/{month:02d}/{sequence:03d}"
+
+
+class RefError(ValueError):
+    """A reference number that cannot be issued"""
+
+
+class DuplicateRefError(RefError):
+    """A hand-entered sequence number that has already been issued"""
+
+
+def parse_sequence(ref_sequence):
+    """A hand-entered sequence number as an int, None when blank.
+
+    Raises RefError unless it is made of digits only and lies between 1 and MAX_SEQUENCE.
+    """
+    ref_sequence = str(ref_sequence or "").strip()
+    if not ref_sequence:
+        return None
+    if not (ref_sequence.isascii() and ref_sequence.isdigit()) or not 1 <= int(ref_sequence) <= MAX_SEQUENCE:
+        raise RefError(f"Reference sequence must be a number from 1 to {MAX_SEQUENCE}, not {ref_sequence!r}")
+    return int(ref_sequence)
+
+
+class RefAllocator:
+    """Hands out per-month reference sequences from a SQLite database in WAL mode.
+
+    Each call claims a contiguous block of sequence numbers in a single
+    IMMEDIATE transaction, so concurrent Streamlit sessions, batch workers and
+    processes never receive the same number, and a batch can reserve all the
+    numbers it needs with one write. Every issued number is also recorded in
+    the issued table, whose primary key refuses a hand-entered sequence that
+    was handed out before. Connections are opened per thread and per process.
+    """
+
+    def __init__(self, path=REF_DB_PATH):
+        self.path = path
+        self._db = LocalConnection(path, self._setup)
+
+    @staticmethod
+    def _setup(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sequences ("
+            " period TEXT PRIMARY KEY,"
+            " last INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS issued ("
+            " period TEXT NOT NULL,"
+            " sequence INTEGER NOT NULL,"
+            " PRIMARY KEY (period, sequence))"
+        )
+
+    def _connection(self):
+        return self._db.get()
+
+    def reserve(self, count=1, when=None):
+        """Claim count consecutive sequence numbers for the month of when, returning (year, month, first).
+
+        Raises RefError if the month has fewer than count numbers left.
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        when = when or datetime.datetime.now()
+        period = f"{when.year:04d}-{when.month:02d}"
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR IGNORE INTO sequences (period, last) VALUES (?, 0)", (period,))
+            conn.execute("UPDATE sequences SET last = last + ? WHERE period = ?", (count, period))
+            (last,) = conn.execute("SELECT last FROM sequences WHERE period = ?", (period,)).fetchone()
+            if last > MAX_SEQUENCE:
+                raise RefError(f"The reference numbers for {when.month:02d}/{when.year} have run out: "
+                               f"{max(MAX_SEQUENCE - last + count, 0)} of {MAX_SEQUENCE} left, {count} needed")
+            conn.executemany("INSERT INTO issued (period, sequence) VALUES (?, ?)",
+                             [(period, sequence) for sequence in range(last - count + 1, last + 1)])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return when.year, when.month, last - count + 1
+
+    def allocate(self, count=1, when=None):
+        """Allocate count reference numbers for the month of when"""
+        year, month, first = self.reserve(count, when)
+        return [format_ref(year, month, sequence) for sequence in range(first, first + count)]
+
+    def next_ref(self, when=None):
+        """Allocate a single reference number"""
+        return self.allocate(1, when)[0]
+
+    def claim(self, sequence, when=None):
+        """Record a hand-picked sequence number so later allocations in its month start above it.
+
+        Raises DuplicateRefError if the number has already been issued.
+        """
+        if not 1 <= sequence <= MAX_SEQUENCE:
+            raise RefError(f"Reference sequence must be a number from 1 to {MAX_SEQUENCE}, not {sequence}")
+        when = when or datetime.datetime.now()
+        period = f"{when.year:04d}-{when.month:02d}"
+        ref_number = format_ref(when.year, when.month, sequence)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO issued (period, sequence) VALUES (?, ?)", (period, sequence))
+            conn.execute("INSERT OR IGNORE INTO sequences (period, last) VALUES (?, 0)", (period,))
+            conn.execute("UPDATE sequences SET last = MAX(last, ?) WHERE period = ?", (sequence, period))
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            raise DuplicateRefError(f"Reference {ref_number} has already been issued")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ref_number
+
+    def ref_for(self, ref_sequence=None, when=None):
+        """Reference number for an optional hand-entered sequence; blank allocates the next one"""
+        sequence = parse_sequence(ref_sequence)
+        if sequence is None:
+            return self.next_ref(when)
+        return self.claim(sequence, when)
+
+    def peek(self, when=None):
+        """Last sequence number handed out for the month of when, 0 if none"""
+        when = when or datetime.datetime.now()
+        row = self._connection().execute(
+            "SELECT last FROM sequences WHERE period = ?", (f"{when.year:04d}-{when.month:02d}",)).fetchone()
+        return row[0] if row else 0
+
+
+# Shared by every caller in the process
+allocator = RefAllocator()
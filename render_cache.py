@@ -0,0 +1,68 @@
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def canonical_hash(data):
+    """Stable SHA-256 of a data dict, independent of key order"""
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Bounded LRU of rendered PDFs keyed by the canonical hash of their data.
+
+    The key covers every field that is printed, including current_date and
+    ref_number, so a cached document is only returned for a submission that
+    would render to the same content. Both an entry count and a total byte
+    budget bound memory.
+    """
+
+    def __init__(self, maxsize=64, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = pdf_bytes
+            self._size += len(pdf_bytes)
+            while self._entries and (len(self._entries) > self.maxsize or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, data, render):
+        """Return cached bytes for data, calling render(data) on a miss"""
+        key = canonical_hash(data)
+        pdf_bytes = self.get(key)
+        if pdf_bytes is None:
+            pdf_bytes = render(data)
+            self.put(key, pdf_bytes)
+        return pdf_bytes
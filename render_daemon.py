@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+from io import BytesIO
+
+SOCKET_PATH = os.environ.get(
+    "SLA_DAEMON_SOCKET", os.path.join(tempfile.gettempdir(), f"sla-render-{os.getuid()}.sock"))
+CONNECT_TIMEOUT = 0.5
+RENDER_TIMEOUT = 60.0
+MAX_REQUEST_BYTES = 1024 * 1024
+
+
+# Messages are a 4-byte big-endian length and a JSON header; a reply that
+# carries a PDF is followed by its bytes.
+def _send(sock, header, payload=b""):
+    body = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(body)) + body + payload)
+
+
+def _recv_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ConnectionError("Connection closed mid-message")
+    return data
+
+
+def _recv_header(stream, limit=MAX_REQUEST_BYTES):
+    (size,) = struct.unpack(">I", _recv_exactly(stream, 4))
+    if size > limit:
+        raise ValueError("Message too large")
+    return json.loads(_recv_exactly(stream, size))
+
+
+def request(message, socket_path=SOCKET_PATH, timeout=RENDER_TIMEOUT):
+    """Send one message to the daemon, returning (reply header, payload) or None when no daemon is listening"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+            return None
+        sock.settimeout(timeout)
+        _send(sock, message)
+        with sock.makefile("rb") as stream:
+            header = _recv_header(stream)
+            payload = _recv_exactly(stream, header.get("size", 0))
+        return header, payload
+    finally:
+        sock.close()
+
+
+def render(data, template, path=None, socket_path=SOCKET_PATH):
+    """Render through the daemon.
+
+    Writes the PDF to path (an absolute path, written by the daemon) and
+    returns it, or returns the PDF bytes when no path is given. Returns None
+    if no daemon is running, so the caller can render in process instead.
+    """
+    reply = request({"op": "render", "template": template, "data": data, "path": path}, socket_path)
+    if reply is None:
+        return None
+    header, payload = reply
+    if not header.get("ok"):
+        raise Exception(header.get("error", "Render daemon failed"))
+    return header["path"] if path else payload
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = _recv_header(self.rfile)
+        except (ConnectionError, ValueError, struct.error):
+            return
+        op = message.get("op")
+        if op == "ping":
+            _send(self.connection, {"ok": True, "pid": os.getpid()})
+        elif op == "stop":
+            _send(self.connection, {"ok": True})
+            self.server.stopping = True
+        elif op == "render":
+            self._render(message)
+        else:
+            _send(self.connection, {"ok": False, "error": f"Unknown op: {op}"})
+
+    def _render(self, message):
+        path = message.get("path")
+        try:
+            if path is not None and not os.path.isabs(path):
+                raise Exception("Output path must be absolute")
+            pdf = self.server.generator.create_pdf(
+                message["data"], subset=self.server.subset, template=message.get("template") or "agreement")
+            if path is None:
+                sink = BytesIO()
+                pdf.output_to(sink)
+                _send(self.connection, {"ok": True, "size": sink.tell()}, sink.getvalue())
+            else:
+                pdf.output_file(path)
+                _send(self.connection, {"ok": True, "path": path})
+        except Exception as e:
+            _send(self.connection, {"ok": False, "error": str(e)})
+
+
+class RenderDaemon(socketserver.UnixStreamServer):
+    """Keeps fonts, images and templates loaded and renders requests one at a time"""
+
+    def __init__(self, socket_path=SOCKET_PATH, templates=("agreement", "letter"), subset=None):
+        # fpdf and the generator are only imported by the daemon, never by the client
+        from generator import DocumentGenerator
+
+        self.generator = DocumentGenerator
+        # The same subset mode as an in-process render, so output does not depend on whether a daemon is running
+        self.subset = subset
+        self.stopping = False
+        if os.path.exists(socket_path):
+            if request({"op": "ping"}, socket_path, CONNECT_TIMEOUT) is not None:
+                raise RuntimeError(f"A render daemon is already listening on {socket_path}")
+            os.unlink(socket_path)
+        for template in templates:
+            DocumentGenerator.load_resources(template, subset=subset)
+        # Only the owner may connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def serve_until_stopped(self):
+        try:
+            while not self.stopping:
+                self.handle_request()
+        finally:
+            self.server_close()
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+
+def main():
+    from subsetting import SUBSET_MODES
+
+    parser = argparse.ArgumentParser(description="Keep SLA rendering resources warm behind a Unix socket")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="socket path (default: $SLA_DAEMON_SOCKET or the temp dir)")
+    parser.add_argument("--stop", action="store_true", help="stop the daemon listening on the socket")
+    parser.add_argument("--subset", choices=SUBSET_MODES, default=None,
+                        help="embed only the glyphs each document uses (the default, as in-process renders do), "
+                             "or the shared Latin business subset")
+    args = parser.parse_args()
+
+    if args.stop:
+        if request({"op": "stop"}, args.socket, CONNECT_TIMEOUT) is None:
+            print("No render daemon is running")
+            return 1
+        return 0
+    daemon = RenderDaemon(args.socket, subset=args.subset)
+    print(f"Render daemon listening on {args.socket}")
+    try:
+        daemon.serve_until_stopped()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
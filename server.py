@@ -0,0 +1,434 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from io import BytesIO
+
+import instrumentation
+from batch import _init_worker, assign_refs, normalize_record
+from compression import COMPRESSION_LEVELS, COMPRESSION_PROFILES
+from generator import DEFAULT_TEMPLATE, DocumentGenerator
+from image_resources import DEFAULT_DPI
+from subsetting import SUBSET_MODES
+from validation import validate_records
+from zip_export import ZipExport
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_EXPORT_BODY_BYTES = 32 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class HTTPError(Exception):
+    """An error answered with an HTTP status instead of a PDF"""
+
+    def __init__(self, status, message=None, headers=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _ChunkedSink:
+    """Collects ZIP output into HTTP/1.1 chunks of about CHUNK_SIZE bytes"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write(b"%x\r\n" % len(self.buffer) + bytes(self.buffer) + b"\r\n")
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.write(b"0\r\n\r\n")
+
+
+def render_bytes(record, subset='document', template=DEFAULT_TEMPLATE, compression=None):
+    """Render one raw record in a worker process, returning (PDF bytes, timing profile or None)"""
+    data = normalize_record(record)
+    with instrumentation.request("server") as profile:
+        pdf = DocumentGenerator.create_pdf(data, subset=subset, template=template, compression=compression)
+        sink = BytesIO()
+        pdf.output_to(sink)
+    return sink.getvalue(), profile
+
+
+def _ready():
+    return os.getpid()
+
+
+class RenderService:
+    """Renders SLAs over HTTP on a bounded pool of pre-warmed worker processes.
+
+    At most ``workers`` renders run at once and at most ``queue_size`` more
+    wait for a worker; anything beyond that is refused with 429 straight away
+    rather than piling up. A request that does not finish within ``timeout``
+    seconds gets 504, and its slot is only released once the worker is done
+    with it, so abandoned renders still count against the limit. A worker
+    that dies breaks the whole pool, so the pool is replaced and the renders
+    that were running on it are retried once before answering 503.
+    """
+
+    def __init__(self, workers=None, queue_size=None, timeout=30.0, subset='document',
+                 background_dpi=DEFAULT_DPI, max_body=MAX_BODY_BYTES, template=DEFAULT_TEMPLATE, compression=None,
+                 max_export_body=MAX_EXPORT_BODY_BYTES):
+        self.workers = workers or os.cpu_count()
+        self.queue_size = self.workers * 4 if queue_size is None else queue_size
+        self.timeout = timeout
+        self.subset = subset
+        self.background_dpi = background_dpi
+        self.max_body = max_body
+        self.max_export_body = max_export_body
+        self.template = template
+        self.compression = compression
+        self.pool = None
+        self.pending = 0
+        # Export rows waiting for the queue bound to leave room, woken as renders finish
+        self.waiters = deque()
+        self.counts = {}
+        self.closing = False
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.background_dpi, self.template, self.subset, self.compression))
+
+    def start(self):
+        """Start the worker processes and wait until each has loaded its resources"""
+        self.pool = self._new_pool()
+        warmup = [self.pool.submit(_ready) for _ in range(self.workers)]
+        return {future.result() for future in warmup}
+
+    def stop(self):
+        self.closing = True
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def _count(self, status):
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+    def _release(self, future):
+        self.pending -= 1
+        # Stage timings are collected in the workers; the parent's /metrics adds them up
+        if not future.cancelled() and future.exception() is None:
+            profile = future.result()[1]
+            if profile is not None:
+                instrumentation.metrics.add(profile)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _full(self):
+        return self.pending >= self.workers + self.queue_size
+
+    async def render(self, record):
+        """Render a record on the pool, enforcing the queue bound and the timeout"""
+        if self.closing:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down")
+        if self._full():
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, "Render queue is full", {"Retry-After": "1"})
+        return await self._submit(record)
+
+    async def render_queued(self, record):
+        """Render a record once the queue bound leaves room for it, instead of refusing it"""
+        while self._full():
+            if self.closing:
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down")
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+        if self.closing:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down")
+        return await self._submit(record)
+
+    def _replace_pool(self, broken):
+        """Swap a pool whose worker died for a fresh one, unless another request already did"""
+        if self.pool is not broken or self.closing:
+            return
+        print("Warning: a render worker died, starting a new worker pool")
+        self.pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, record):
+        """Render on the pool, retrying once on a fresh pool if a worker dies"""
+        for _ in range(2):
+            pool = self.pool
+            try:
+                return await self._run(pool, record)
+            except BrokenProcessPool:
+                # Every render in flight on the broken pool lands here; the first one replaces it
+                self._replace_pool(pool)
+        raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Worker pool is unavailable")
+
+    async def _run(self, pool, record):
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(pool, render_bytes, record, self.subset,
+                                          self.template, self.compression)
+        except BrokenProcessPool:
+            raise
+        except RuntimeError:
+            # Shut down by stop()
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Worker pool is unavailable")
+        self.pending += 1
+        future.add_done_callback(self._release)
+        try:
+            # shield() keeps the worker's result from being cancelled on timeout
+            pdf_bytes, _ = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            return pdf_bytes
+        except asyncio.TimeoutError:
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, f"Render took longer than {self.timeout:g}s")
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+
+    async def export(self, records, writer):
+        """Render records on the pool and stream them into a chunked ZIP response in order.
+
+        At most one render per worker is in flight, so memory holds a few
+        PDFs however many records there are. Rows wait for room in the render
+        queue rather than being refused when /render traffic fills it.
+        Records that fail are listed with their error in the manifest.
+        """
+        report = validate_records(records, self.template)
+        records = [dict(record) for record in records]
+        assign_refs([record for index, record in enumerate(records, start=1) if index not in report])
+        sink = _ChunkedSink(writer)
+        export = ZipExport(sink)
+        window = deque()
+        try:
+            for index, record in enumerate(records, start=1):
+                if index in report:
+                    export.add_error(index, record, report.message(index))
+                    continue
+                try:
+                    data = normalize_record(record)
+                except Exception as e:
+                    export.add_error(index, record, str(e))
+                    continue
+                window.append((index, data, asyncio.ensure_future(self.render_queued(data))))
+                if len(window) >= self.workers:
+                    await self._export_next(export, window, writer)
+            while window:
+                await self._export_next(export, window, writer)
+            export.close()
+            sink.close()
+            await writer.drain()
+        finally:
+            for _, _, task in window:
+                task.cancel()
+
+    async def _export_next(self, export, window, writer):
+        index, data, task = window.popleft()
+        try:
+            export.add_bytes(index, data, await task)
+        except HTTPError as e:
+            export.add_error(index, data, str(e))
+        await writer.drain()
+
+    def metrics(self):
+        """Server counters followed by the stage timing snapshot"""
+        lines = [
+            "# HELP sla_server_pending Renders running or queued.",
+            "# TYPE sla_server_pending gauge",
+            f"sla_server_pending {self.pending}",
+            "# HELP sla_server_responses_total Responses by HTTP status.",
+            "# TYPE sla_server_responses_total counter",
+        ]
+        for status in sorted(self.counts):
+            lines.append(f'sla_server_responses_total{{status="{status}"}} {self.counts[status]}')
+        return "\n".join(lines) + "\n" + instrumentation.prometheus_snapshot()
+
+    async def handle(self, reader, writer):
+        """Serve requests on one connection until the client closes it"""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, content_type, payload, extra = await self._dispatch(method, path, body)
+                except HTTPError as e:
+                    status, content_type, extra = e.status, "application/json", e.headers
+                    payload = json.dumps({"error": str(e)}).encode("utf-8")
+                await self._respond(writer, status, content_type, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            # Malformed request: answer once and drop the connection
+            payload = json.dumps({"error": str(e)}).encode("utf-8")
+            await self._respond(writer, e.status, "application/json", payload, e.headers, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HTTPError(HTTPStatus.BAD_REQUEST)
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED)
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        limit = self.max_export_body if path.split("?", 1)[0] == "/export" else self.max_body
+        if length > limit:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, method, path, body):
+        if path == "/render":
+            if method != "POST":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, headers={"Allow": "POST"})
+            try:
+                record = json.loads(body)
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+            # Accept either the data dict itself or {"data": {...}}
+            if isinstance(record, dict) and isinstance(record.get("data"), dict):
+                record = record["data"]
+            if not isinstance(record, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+            # Invalid input is refused before it takes up a worker
+            report = validate_records([record], self.template)
+            if report:
+                raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, report.message(1))
+            pdf_bytes = await self.render(record)
+            client = str(record.get("client_name", "")).replace(" ", "_").replace('"', "")
+            disposition = f'attachment; filename="SLA_{client}_{time.strftime("%Y%m%d")}.pdf"'
+            return HTTPStatus.OK, "application/pdf", pdf_bytes, {"Content-Disposition": disposition}
+        if path == "/export":
+            if method != "POST":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, headers={"Allow": "POST"})
+            # A JSON array of records, or one record per line
+            try:
+                text = body.decode("utf-8")
+                records = json.loads(text) if text.lstrip().startswith("[") else [
+                    json.loads(line) for line in text.splitlines() if line.strip()]
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON array or JSON lines of records")
+            if not records or not all(isinstance(record, dict) for record in records):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON array or JSON lines of records")
+            if self.closing:
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down")
+            disposition = f'attachment; filename="SLA_export_{time.strftime("%Y%m%d")}.zip"'
+
+            async def stream(writer):
+                await self.export(records, writer)
+
+            return HTTPStatus.OK, "application/zip", stream, {"Content-Disposition": disposition}
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, headers={"Allow": "GET"})
+        if path == "/healthz":
+            health = {"status": "ok", "workers": self.workers, "pending": self.pending,
+                      "queue_size": self.queue_size}
+            return HTTPStatus.OK, "application/json", json.dumps(health).encode("utf-8"), {}
+        if path == "/metrics":
+            return HTTPStatus.OK, "text/plain; version=0.0.4", self.metrics().encode("utf-8"), {}
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    async def _respond(self, writer, status, content_type, payload, extra, keep_alive):
+        self._count(int(status))
+        # A callable payload streams its body and is sent with chunked encoding
+        streaming = callable(payload)
+        head = [
+            f"HTTP/1.1 {int(status)} {status.phrase}",
+            f"Content-Type: {content_type}",
+            "Transfer-Encoding: chunked" if streaming else f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        head.extend(f"{name}: {value}" for name, value in extra.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if streaming:
+            await payload(writer)
+            return
+        # Stream the PDF in chunks so a slow client only holds one chunk in the transport
+        view = memoryview(payload)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            writer.write(view[offset:offset + CHUNK_SIZE])
+            await writer.drain()
+        await writer.drain()
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(service.handle, host, port, limit=MAX_HEADER_BYTES)
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Serving SLA renders on {addresses} with {service.workers} workers")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SLA PDF rendering over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="renders allowed to wait for a worker before returning 429 (default: 4 per worker)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request is answered with 504")
+    parser.add_argument("--subset", choices=SUBSET_MODES, default="document",
+                        help="embed only the glyphs each document uses, or the shared Latin business subset")
+    parser.add_argument("--background-dpi", type=int, default=DEFAULT_DPI,
+                        help="resample images to this resolution (0 embeds the original files)")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE,
+                        help="template name in templates/ or path to a template file")
+    parser.add_argument("--compression", choices=[*COMPRESSION_LEVELS, *COMPRESSION_PROFILES], default="default",
+                        help="deflate level for page and font streams")
+    args = parser.parse_args()
+
+    service = RenderService(args.workers, args.queue_size, args.timeout, args.subset, args.background_dpi or None,
+                            template=args.template, compression=args.compression)
+    service.start()
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import threading
+
+BUSY_TIMEOUT_MS = 10000
+
+
+class LocalConnection:
+    """One SQLite connection per thread and per process, in WAL mode with a busy timeout.
+
+    Connections are opened in autocommit mode so callers manage their own
+    IMMEDIATE transactions. setup is called with each new connection to
+    create the schema.
+    """
+
+    def __init__(self, path, setup=None, row_factory=None):
+        self.path = path
+        self.setup = setup
+        self.row_factory = row_factory
+        self._local = threading.local()
+
+    def get(self):
+        """The calling thread's connection, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited across fork() must not be reused
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            if self.setup is not None:
+                self.setup(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
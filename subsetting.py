@@ -0,0 +1,118 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+
+# Precomputed "Latin business" character set: printable ASCII, Latin-1 and
+# the typographic punctuation that shows up in pasted business text.
+LATIN_BUSINESS = frozenset(range(32, 127)) | frozenset(range(160, 256)) | frozenset((
+    0x2013, 0x2014, 0x2018, 0x2019, 0x201C, 0x201D, 0x2022, 0x2026, 0x20AC, 0x2122,
+))
+
+SUBSET_MODES = ('document', 'latin')
+
+
+class GlyphSubset:
+    """Set of code points used with a font.
+
+    FPDF appends every rendered character to the font's subset list, so long
+    documents accumulate thousands of duplicates that the font subsetter then
+    scans quadratically. This keeps only distinct code points.
+    """
+
+    def __init__(self, codes=()):
+        self.codes = set(codes)
+
+    def append(self, code):
+        self.codes.add(code)
+
+    def __contains__(self, code):
+        return code in self.codes
+
+    def __iter__(self):
+        return iter(sorted(self.codes))
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class _Capture:
+    """Stand-in for an FPDF instance that collects _out() lines"""
+
+    def __init__(self):
+        self.lines = []
+
+    def _out(self, s):
+        self.lines.append(s)
+
+
+class SubsetCache:
+    """Builds embedded font subsets and keeps the most recent ones per process.
+
+    An entry holds everything _putfonts needs for one face, one set of code
+    points and one deflate level: the glyph program, its CIDToGIDMap and the
+    /W widths array. Documents that share a subset, such as every document rendered in
+    'latin' mode, reuse the same entry.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, font, codes, level=zlib.Z_DEFAULT_COMPRESSION):
+        """Subset of a face for a set of code points; a level of None leaves the streams uncompressed"""
+        key = (font['ttffile'], codes, level)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._build(font, codes, level)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _build(font, codes, level):
+        ttf = TTFontFile()
+        ttfontstream = ttf.makeSubset(font['ttffile'], sorted(codes))
+        cidtogidmap = bytearray(256 * 256 * 2)
+        for cc, glyph in ttf.codeToGlyph.items():
+            cidtogidmap[cc * 2] = glyph >> 8
+            cidtogidmap[cc * 2 + 1] = glyph & 0xFF
+        capture = _Capture()
+        FPDF._putTTfontwidths(capture, dict(font, subset=codes), ttf.maxUni)
+        fontstream = ttfontstream
+        cidtogidmap = bytes(cidtogidmap)
+        if level is not None:
+            fontstream = zlib.compress(fontstream, level)
+            cidtogidmap = zlib.compress(cidtogidmap, level)
+        return {
+            'fontstream': fontstream,
+            'length1': len(ttfontstream),
+            'cidtogidmap': cidtogidmap,
+            'widths': capture.lines[0],
+        }
+
+
+def subset_codes(font, mode):
+    """Code points to embed for a font under the given subsetting mode"""
+    codes = set(font['subset'])
+    codes.discard(0)
+    if mode == 'latin' and codes <= LATIN_BUSINESS | set(range(1, 57)):
+        # Every document maps onto the same precomputed subset
+        return LATIN_BUSINESS
+    return frozenset(codes)
+
+
+# Shared by every template in the process
+subset_cache = SubsetCache()
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import string
+import threading
+
+from layout import TemplateSkeleton
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+# Template rendered when none is named, in templates/agreement.json
+DEFAULT_TEMPLATE = 'agreement'
+
+# Keys each block type accepts, with their defaults
+BLOCK_TYPES = {
+    'font': {'style': '', 'size': 10},
+    'cell': {'w': 0, 'h': 6, 'text': '', 'border': 0, 'ln': 0, 'align': 'L'},
+    'text': {'w': 0, 'h': 6, 'text': '', 'align': 'J'},
+    'space': {'h': None},
+    'move': {'dy': 0},
+    'rule': {'from': None},
+    'annex': {'rows': None, 'title': '', 'columns': None, 'h': 6, 'size': 9},
+}
+# Keys of each column of an annex table
+COLUMN_KEYS = {'title': '', 'text': '', 'w': None, 'align': 'L'}
+REQUIRED_KEYS = {'name', 'version', 'fonts', 'blocks'}
+
+
+class TemplateError(Exception):
+    """A template file that cannot be compiled"""
+
+
+def _bullets(values, spec):
+    strip = spec.get('strip', False)
+    if strip:
+        return "\n".join(f"- {value.strip()}" for value in values if value.strip())
+    return "\n".join(f"- {value}" for value in values)
+
+
+def _sum(values, spec):
+    return sum(values)
+
+
+# Computed field kinds: the key names the kind, its value the source field(s)
+FIELD_KINDS = {
+    'bullets': _bullets,
+    'sum': _sum,
+}
+
+
+class _Text:
+    """A block's text, formatted per document only when it contains fields"""
+    __slots__ = ('source', 'fields')
+
+    def __init__(self, source, where):
+        if isinstance(source, list):
+            source = "\n".join(source)
+        if not isinstance(source, str):
+            raise TemplateError(f"{where}: text must be a string or a list of lines")
+        try:
+            parsed = list(string.Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"{where}: {str(e)}")
+        self.source = source
+        # Root names only: "payment_terms[advance]" needs the payment_terms field
+        self.fields = frozenset(
+            field.split('[', 1)[0].split('.', 1)[0]
+            for _, field, _, _ in parsed if field is not None
+        )
+        if '' in self.fields:
+            raise TemplateError(f"{where}: positional fields are not supported")
+
+    def render(self, values):
+        return self.source.format_map(values) if self.fields else self.source
+
+
+def _draw_annex(pdf, family, title, columns, rows, h, size):
+    """A table on pages of its own, repeating the column headings after every page break.
+
+    Cell texts wrap within their column, and rows are never split across pages.
+    """
+    pdf.add_page()
+    if title:
+        pdf.set_font(family, 'B', 12)
+        pdf.cell(0, 8, title, 0, 1)
+        pdf.ln(2)
+
+    def headings():
+        pdf.set_font(family, 'B', size)
+        for w, heading, _ in columns:
+            pdf.cell(w, h, heading, 1, 0, 'C')
+        pdf.ln(h)
+        pdf.set_font(family, '', size)
+
+    headings()
+    for row in rows:
+        cells = list(zip(columns, row))
+        # Long texts wrap within their column; the tallest column sets the row height
+        if all('\n' not in text and pdf.get_string_width(text) <= w - 2 * pdf.c_margin
+               for (w, _, _), text in cells):
+            height = h
+        else:
+            height = h * max(max(1, len(pdf.multi_cell(w, h, text, 0, align, split_only=True)))
+                             for (w, _, align), text in cells)
+        if pdf.get_y() + height > pdf.page_break_trigger:
+            pdf.add_page()
+            headings()
+        if height == h:
+            for (w, _, align), text in cells:
+                pdf.cell(w, h, text, 1, 0, align)
+            pdf.ln(h)
+            continue
+        x, y = pdf.get_x(), pdf.get_y()
+        for (w, _, align), text in cells:
+            pdf.rect(x, y, w, height)
+            pdf.set_xy(x, y)
+            pdf.multi_cell(w, h, text, 0, align)
+            x += w
+        pdf.set_xy(pdf.l_margin, y + height)
+
+
+class RenderPlan:
+    """A compiled template: validated blocks ready to be replayed on an SLATemplate.
+
+    Compiling checks the block types, their keys and every format string once,
+    so rendering a document only formats the texts that contain fields and
+    calls the matching fpdf methods.
+    """
+
+    def __init__(self, spec, path, digest):
+        self.path = path
+        self.digest = digest
+        self.name = spec['name']
+        self.title = spec.get('title', '')
+        self.version = spec['version']
+        fonts = spec['fonts']
+        if not isinstance(fonts, dict) or 'family' not in fonts:
+            raise TemplateError(f"{path}: fonts needs a family")
+        self.font_family = fonts['family']
+        self.font_files = fonts.get('files', {})
+        self.font_fallback = fonts.get('fallback', self.font_family)
+
+        self.computed = []
+        for name, field in spec.get('fields', {}).items():
+            kinds = [kind for kind in field if kind in FIELD_KINDS]
+            if len(kinds) != 1:
+                raise TemplateError(f"{path}: field {name} needs exactly one of {', '.join(FIELD_KINDS)}")
+            sources = field[kinds[0]]
+            self.computed.append((name, FIELD_KINDS[kinds[0]], sources, field))
+
+        self.ops = []
+        texts = []
+        for index, block in enumerate(spec['blocks']):
+            where = f"{path}: block {index + 1}"
+            kind = block.get('type')
+            if kind not in BLOCK_TYPES:
+                raise TemplateError(f"{where}: unknown block type {kind!r}")
+            unknown = set(block) - set(BLOCK_TYPES[kind]) - {'type'}
+            if unknown:
+                raise TemplateError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+            options = dict(BLOCK_TYPES[kind], **block)
+            if kind == 'cell':
+                text = _Text(options['text'], where)
+                self.ops.append((kind, (options['w'], options['h'], text, options['border'],
+                                        options['ln'], options['align'])))
+                texts.append(text)
+            elif kind == 'text':
+                text = _Text(options['text'], where)
+                self.ops.append((kind, (options['w'], options['h'], text, options['align'])))
+                texts.append(text)
+            elif kind == 'font':
+                self.ops.append((kind, (options['style'], options['size'])))
+            elif kind == 'space':
+                self.ops.append((kind, options['h']))
+            elif kind == 'move':
+                self.ops.append((kind, options['dy']))
+            elif kind == 'rule':
+                if not isinstance(options['from'], list) or len(options['from']) != 2:
+                    raise TemplateError(f"{where}: rule needs from: [x1, x2]")
+                self.ops.append((kind, tuple(options['from'])))
+            elif kind == 'annex':
+                self.ops.append((kind, self._annex(options, where)))
+
+        # Optional list fields drawn as annex tables, with the column texts formatted per row
+        self.annexes = {
+            args[0]: [text for _, _, text, _ in args[2]] for kind, args in self.ops if kind == 'annex'
+        }
+        computed = {name for name, _, _, _ in self.computed}
+        sources = set()
+        for _, _, source, _ in self.computed:
+            sources.update([source] if isinstance(source, str) else source)
+        # Data fields a document must provide
+        self.fields = frozenset(
+            field for text in texts for field in text.fields if field not in computed
+        ) | sources
+        # Lines without fields are laid out once per process
+        self.skeleton = TemplateSkeleton(self.version, [
+            line for text in texts if text.source
+            for line in text.source.split('\n') if not _Text(line, path).fields
+        ])
+
+    @staticmethod
+    def _annex(options, where):
+        rows = options['rows']
+        if not isinstance(rows, str) or not rows:
+            raise TemplateError(f"{where}: annex needs rows: the name of a list field")
+        if not isinstance(options['columns'], list) or not options['columns']:
+            raise TemplateError(f"{where}: annex needs a list of columns")
+        if _Text(options['title'], where).fields:
+            raise TemplateError(f"{where}: an annex title cannot contain fields")
+        columns = []
+        for number, column in enumerate(options['columns'], start=1):
+            if not isinstance(column, dict) or set(column) - set(COLUMN_KEYS):
+                raise TemplateError(f"{where}: column {number} takes only {', '.join(COLUMN_KEYS)}")
+            column = dict(COLUMN_KEYS, **column)
+            if not isinstance(column['w'], (int, float)) or column['w'] <= 0:
+                raise TemplateError(f"{where}: column {number} needs a width w")
+            # Column texts are formatted with the fields of each row
+            columns.append((column['w'], column['title'], _Text(column['text'], where), column['align']))
+        return rows, options['title'], columns, options['h'], options['size']
+
+    def values(self, data):
+        """The data dict plus the template's computed fields"""
+        values = dict(data)
+        for name, compute, sources, field in self.computed:
+            if isinstance(sources, str):
+                values[name] = compute(data[sources], field)
+            else:
+                values[name] = compute([data[source] for source in sources], field)
+        return values
+
+    def prepare(self, data):
+        """Format every text for one document, so missing fields fail before anything is drawn"""
+        values = self.values(data)
+        ops = []
+        for kind, args in self.ops:
+            if kind in ('cell', 'text'):
+                args = (*args[:2], args[2].render(values), *args[3:])
+            elif kind == 'annex':
+                field, title, columns, h, size = args
+                rows = values.get(field)
+                if not rows:
+                    continue
+                args = (title, [(w, heading, align) for w, heading, _, align in columns],
+                        [[text.render(row) for _, _, text, _ in columns] for row in rows], h, size)
+            ops.append((kind, args))
+        return ops
+
+    def render(self, pdf, data, family=None):
+        """Replay the blocks onto pdf, which must already have a page"""
+        self.draw(pdf, self.prepare(data), family)
+
+    def draw(self, pdf, ops, family=None):
+        """Replay prepared blocks onto pdf"""
+        family = family or self.font_family
+        for kind, args in ops:
+            if kind == 'cell':
+                w, h, text, border, ln, align = args
+                pdf.cell(w, h, text, border, ln, align)
+            elif kind == 'text':
+                w, h, text, align = args
+                pdf.multi_cell(w, h, text, 0, align)
+            elif kind == 'font':
+                pdf.set_font(family, *args)
+            elif kind == 'space':
+                pdf.ln(args)
+            elif kind == 'move':
+                pdf.set_y(pdf.get_y() + args)
+            elif kind == 'rule':
+                y = pdf.get_y()
+                pdf.line(args[0], y, args[1], y)
+            elif kind == 'annex':
+                _draw_annex(pdf, family, *args)
+
+
+class TemplateCompiler:
+    """Compiles template files into render plans and keeps them in memory.
+
+    A cached plan is reused while the file's mtime and size are unchanged;
+    when they change the file is hashed and only recompiled if its contents
+    actually differ.
+    """
+
+    def __init__(self, directory=TEMPLATE_DIR):
+        self.directory = directory
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        """Resolve a template name or path to a file"""
+        if os.sep in name or name.endswith('.json'):
+            return name
+        return os.path.join(self.directory, name + '.json')
+
+    def names(self):
+        """Names of the templates in the template directory"""
+        try:
+            return sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith('.json'))
+        except OSError:
+            return []
+
+    def load(self, name):
+        """Return the render plan for a template, recompiling it if the file changed"""
+        path = self.path(name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise TemplateError(f"Template not found: {name}")
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._plans.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with self._lock:
+            cached = self._plans.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            with open(path, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if cached is not None and cached[1].digest == digest:
+                plan = cached[1]
+            else:
+                plan = self.compile(raw, path, digest)
+            self._plans[path] = (stamp, plan)
+            return plan
+
+    @staticmethod
+    def compile(raw, path='<template>', digest=None):
+        """Parse and validate template JSON into a render plan"""
+        try:
+            spec = json.loads(raw)
+        except ValueError as e:
+            raise TemplateError(f"{path}: {str(e)}")
+        if not isinstance(spec, dict):
+            raise TemplateError(f"{path}: a template is a JSON object")
+        missing = REQUIRED_KEYS - set(spec)
+        if missing:
+            raise TemplateError(f"{path}: missing {', '.join(sorted(missing))}")
+        return RenderPlan(spec, path, digest or hashlib.sha256(raw).hexdigest())
+
+
+# Shared by every generator in the process
+compiler = TemplateCompiler()
@@ -0,0 +1,214 @@
+import math
+import re
+
+from ref_allocator import MAX_SEQUENCE, RefError, parse_sequence
+from template_compiler import DEFAULT_TEMPLATE, FIELD_KINDS, compiler
+
+# Fields of the App.py ``data`` dict that are rendered with numeric formatting
+FLOAT_FIELDS = (
+    "company_formation_cost", "desk_space_cost", "businessman_visa_cost",
+    "misc_charges", "poa_cost", "estimation_charges", "labor_auth_cost",
+    "social_insurance_cost", "free_advice_cost", "vat_registration_fee",
+    "consultancy_fee",
+)
+# Whole-number percentages
+INT_FIELDS = (
+    "bahraini_ownership", "gcc_ownership", "american_ownership",
+    "foreign_ownership", "advance_payment", "remaining_payment",
+)
+# List fields that may also be given as one comma-separated string
+SPLIT_FIELDS = ("services",)
+# Filled in by normalize_record when a record leaves them out
+DEFAULTED_FIELDS = ("current_date", "ref_number")
+
+# Percentages that must add up to 100; dotted names reach into nested dicts
+PERCENT_GROUPS = {
+    "ownership": ("bahraini_ownership", "gcc_ownership", "american_ownership", "foreign_ownership"),
+    "payment": ("advance_payment", "remaining_payment"),
+    "payment_terms": ("payment_terms.advance", "payment_terms.remaining"),
+}
+
+# Formats of text fields, checked when they are not blank
+EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s.]+")
+CR_NUMBER = re.compile(r"\d{1,7}(-\d{1,4})?")
+ISIC_CODE = re.compile(r"\d{4}(\.?\d{2})?")
+FORMATS = {
+    "email": (EMAIL, "not a valid email address"),
+    "commercial_registration_number": (CR_NUMBER, "not a CR number such as 12345-1"),
+    "isic_code_1": (ISIC_CODE, "not an ISIC Rev.4 code such as 6201"),
+    "isic_code_2": (ISIC_CODE, "not an ISIC Rev.4 code such as 6201"),
+}
+
+MISSING = object()
+
+
+def _get(record, name):
+    value = record
+    for part in name.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def _numbers(column, integer=False):
+    """Parse a column the way normalize_record does, None marking values that are not numbers"""
+    parsed = []
+    for value in column:
+        try:
+            number = float(value or 0)
+            if not math.isfinite(number):
+                raise ValueError
+            parsed.append(int(number) if integer else number)
+        except (TypeError, ValueError):
+            parsed.append(None)
+    return parsed
+
+
+class ValidationReport:
+    """Errors found in an input table, as messages per 1-based row number"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __contains__(self, index):
+        return index in self.errors
+
+    def add(self, index, field, message):
+        self.errors.setdefault(index, []).append(f"{field}: {message}")
+
+    def message(self, index):
+        """All problems of one row in a single line"""
+        return "; ".join(self.errors[index])
+
+    def lines(self):
+        """The full report, one line per invalid row"""
+        return [f"Record {index}: {self.message(index)}" for index in sorted(self.errors)]
+
+
+def validate_records(records, template=DEFAULT_TEMPLATE):
+    """Check a whole input table against a template before anything is rendered.
+
+    Each check runs over one column of the table at a time: required fields,
+    numeric types and ranges, percentage groups that must add up to 100,
+    annex rows, and the email, CR number and ISIC code formats.
+    """
+    plan = compiler.load(template)
+    records = list(records)
+    report = ValidationReport(len(records))
+    indices = range(1, len(records) + 1)
+    rows = []
+    for index, record in zip(indices, records):
+        if isinstance(record, dict):
+            rows.append((index, record))
+        else:
+            report.add(index, "record", "not a JSON object")
+
+    def column(name):
+        return [_get(record, name) for _, record in rows]
+
+    # Schema: every field the template prints or computes from
+    for name in sorted(plan.fields - set(DEFAULTED_FIELDS)):
+        for (index, _), value in zip(rows, column(name)):
+            if value is MISSING:
+                report.add(index, name, "missing")
+
+    # Lists the template turns into bullets
+    bullets = FIELD_KINDS["bullets"]
+    for _, compute, sources, _ in plan.computed:
+        if compute is not bullets or sources not in plan.fields:
+            continue
+        for (index, _), value in zip(rows, column(sources)):
+            if value is MISSING or (isinstance(value, str) and sources in SPLIT_FIELDS):
+                continue
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                report.add(index, sources, "must be a list of strings")
+
+    # Numbers: costs and anything summed by the template must parse and not be negative
+    summed = {
+        source for _, compute, sources, _ in plan.computed if compute is FIELD_KINDS["sum"]
+        for source in sources
+    }
+    numeric = {name: False for name in FLOAT_FIELDS if name in plan.fields}
+    numeric.update((name, False) for name in summed)
+    numeric.update((name, True) for name in INT_FIELDS if name in plan.fields)
+    parsed = {}
+    for name, integer in sorted(numeric.items()):
+        values = column(name)
+        parsed[name] = _numbers(values, integer)
+        for (index, _), value, number in zip(rows, values, parsed[name]):
+            if value is MISSING:
+                continue
+            if number is None:
+                report.add(index, name, f"not a number ({value!r})")
+            elif number < 0:
+                report.add(index, name, "must not be negative")
+            elif integer and number > 100:
+                report.add(index, name, "is a percentage above 100")
+
+    # Percentage groups
+    for group, names in PERCENT_GROUPS.items():
+        if any(name.split(".", 1)[0] not in plan.fields for name in names):
+            continue
+        columns = []
+        for name in names:
+            if name not in parsed:
+                parsed[name] = _numbers(column(name))
+            columns.append(parsed[name])
+        raw = [column(name) for name in names]
+        for position, (index, _) in enumerate(rows):
+            if any(values[position] is MISSING for values in raw):
+                continue
+            numbers = [values[position] for values in columns]
+            if None in numbers:
+                if any(name not in numeric for name in names):
+                    report.add(index, group, "percentages must be numbers")
+                continue
+            total = sum(numbers)
+            if abs(total - 100) > 1e-6:
+                report.add(index, group, f"percentages add up to {total:g}, not 100")
+
+    # Annex tables: optional lists of rows that every column must be able to format
+    for name, texts in plan.annexes.items():
+        for (index, _), value in zip(rows, column(name)):
+            if value is MISSING or not value:
+                continue
+            if not isinstance(value, list) or not all(isinstance(row, dict) for row in value):
+                report.add(index, name, "must be a list of objects")
+                continue
+            for number, row in enumerate(value, start=1):
+                try:
+                    for text in texts:
+                        text.render(row)
+                except KeyError as e:
+                    report.add(index, name, f"row {number}: missing {e}")
+                    break
+                except (ValueError, TypeError, IndexError) as e:
+                    report.add(index, name, f"row {number}: {e}")
+                    break
+
+    # Text formats
+    for name, (pattern, message) in FORMATS.items():
+        if name not in plan.fields:
+            continue
+        for (index, _), value in zip(rows, column(name)):
+            if value is MISSING:
+                continue
+            text = str(value).strip()
+            if text and not pattern.fullmatch(text):
+                report.add(index, name, f"{message} ({text!r})")
+
+    # Hand-entered reference sequences, unless the row already carries its reference number
+    for (index, record), value in zip(rows, column("ref_sequence")):
+        if value is MISSING or record.get("ref_number"):
+            continue
+        try:
+            parse_sequence(value)
+        except RefError:
+            report.add(index, "ref_sequence", f"not a sequence number from 1 to {MAX_SEQUENCE} ({value!r})")
+
+    return report
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import shutil
+import tempfile
+import zipfile
+
+import instrumentation
+from batch import normalize_record, output_filename
+from generator import DEFAULT_TEMPLATE, DocumentGenerator
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class _HashingWriter:
+    """Passes PDF bytes through to a file while hashing and counting them"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+class ZipExport:
+    """Writes PDFs into a ZIP archive one at a time, followed by a manifest.
+
+    Each document is serialized into a temporary file and then copied into
+    its own entry, so only the document being written is ever in memory and
+    a document that fails to serialize leaves nothing behind. The sink may be a file on
+    disk or any write-only stream such as an HTTP response body; ZIP data
+    descriptors mean nothing has to be seeked back to. Manifest lines, one per
+    record including the failed ones, are spooled to a temporary file and
+    added as manifest.jsonl when the export is closed.
+    """
+
+    def __init__(self, sink, compresslevel=1):
+        # PDF streams are already deflated; a fast level still shrinks the xref and object headers
+        self.zip = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self.manifest = tempfile.TemporaryFile()
+        self.generated = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, entry):
+        self.manifest.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def add_pdf(self, index, data, pdf):
+        """Stream a rendered document into the archive once it has been serialized completely"""
+        name = output_filename(index, data)
+        # Spooled to a temporary file first, so a document that fails partway leaves no truncated entry
+        with tempfile.TemporaryFile() as spool:
+            writer = _HashingWriter(spool)
+            pdf.output_to(writer)
+            spool.seek(0)
+            with self.zip.open(name, "w") as entry:
+                shutil.copyfileobj(spool, entry)
+        self._added(index, data, name, writer.size, writer.sha256.hexdigest())
+
+    def add_bytes(self, index, data, pdf_bytes):
+        """Add a document that was rendered elsewhere"""
+        name = output_filename(index, data)
+        self.zip.writestr(name, pdf_bytes)
+        self._added(index, data, name, len(pdf_bytes), hashlib.sha256(pdf_bytes).hexdigest())
+
+    def _added(self, index, data, name, size, sha256):
+        self.generated += 1
+        self._record({
+            "index": index, "file": name, "client_name": data.get("client_name"),
+            "ref_number": data.get("ref_number"), "size": size, "sha256": sha256,
+        })
+
+    def add_error(self, index, record, error):
+        """Note a record that could not be rendered"""
+        self.failed += 1
+        client_name = record.get("client_name") if isinstance(record, dict) else None
+        self._record({"index": index, "client_name": client_name, "error": error})
+
+    def close(self):
+        """Write the manifest and finish the archive"""
+        if self.manifest.closed:
+            return
+        self.manifest.seek(0)
+        with self.zip.open(MANIFEST_NAME, "w") as entry:
+            shutil.copyfileobj(self.manifest, entry)
+        self.manifest.close()
+        self.zip.close()
+
+
+def export_zip(records, sink, subset='document', template=DEFAULT_TEMPLATE, compression=None, report=None):
+    """Render records one by one straight into a ZIP archive, returning (generated, failed).
+
+    Rows with errors in report, a validation.ValidationReport, are listed in
+    the manifest without being rendered.
+    """
+    with ZipExport(sink) as export:
+        for index, record in enumerate(records, start=1):
+            if report is not None and index in report:
+                export.add_error(index, record, report.message(index))
+                continue
+            try:
+                data = normalize_record(record)
+                with instrumentation.request(f"zip:{index}"):
+                    pdf = DocumentGenerator.create_pdf(data, subset=subset, template=template,
+                                                       compression=compression)
+                    export.add_pdf(index, data, pdf)
+            except Exception as e:
+                export.add_error(index, record, str(e))
+    return export.generated, export.failed